@@ -0,0 +1,51 @@
+# Re-encode every wardrobe item with the vocabulary of a newly deployed model and
+# store the codes in wardrobe_item_codes. Run from apka/backend:
+#   python -m database.backfill_codes network/final30.pth [--prune]
+
+import argparse
+from network.train.vocabulary import Vocabulary, vocabulary_path
+from .db_engine import Base, SessionLocal, engine
+from .db_schema import WardrobeItemDB, WardrobeItemCodeDB
+from .item_codes import store_item_codes
+
+
+# encode all items in batches of batch_size (one commit per batch)
+# prune=True removes codes of every other vocabulary version afterwards
+def backfill(db, vocab, batch_size=1000, prune=False):
+    last_id, total = 0, 0
+    while True:
+        items = (db.query(WardrobeItemDB).filter(WardrobeItemDB.id > last_id)
+                 .order_by(WardrobeItemDB.id).limit(batch_size).all())
+        if not items:
+            break
+        store_item_codes(db, vocab, items)
+        db.commit()
+        last_id = items[-1].id
+        total += len(items)
+
+    pruned = 0
+    if prune:
+        pruned = db.query(WardrobeItemCodeDB).filter(WardrobeItemCodeDB.vocab_version != vocab.version).delete()
+        db.commit()
+    return total, pruned
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store model category codes for all wardrobe items.")
+    parser.add_argument("model_path", help="Checkpoint whose .vocab.json defines the codes")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Items encoded per commit")
+    parser.add_argument("--prune", action="store_true", help="Delete codes of other vocabulary versions")
+    args = parser.parse_args()
+
+    vocab = Vocabulary.load(vocabulary_path(args.model_path))
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        total, pruned = backfill(db, vocab, args.batch_size, args.prune)
+    finally:
+        db.close()
+    print(f"Encoded {total} items with vocabulary {vocab.version}, pruned {pruned} old codes.")
+
+
+if __name__ == "__main__":
+    main()
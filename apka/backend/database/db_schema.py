@@ -21,6 +21,22 @@ class WardrobeItemDB(Base):
 
     user = relationship("UserDB", back_populates="wardrobe_items")
 
+# schema of wardrobe_item_codes table
+# model category codes of a wardrobe item, computed at write time for one vocabulary version
+# (codes of the "<slot>_<attribute>" columns of the slot the item belongs to)
+class WardrobeItemCodeDB(Base):
+    __tablename__ = "wardrobe_item_codes"
+
+    item_id = Column(Integer, ForeignKey("wardrobe_items.id"), primary_key=True)
+    vocab_version = Column(String, primary_key=True)
+    slot = Column(String)
+    type_code = Column(Integer)
+    color_code = Column(Integer)
+    material_code = Column(Integer)
+    size_code = Column(Integer)
+    style_code = Column(Integer)
+    special_property_code = Column(Integer)
+
 # schema of users table
 class UserDB(Base):
     __tablename__ = "users"
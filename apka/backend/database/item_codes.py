@@ -0,0 +1,103 @@
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from .db_schema import WardrobeItemDB, WardrobeItemCodeDB
+
+# pandas and the network package are imported inside the functions, so that importing
+# this module (e.g. from main) does not load the recommender's dependencies
+
+# columns of wardrobe_item_codes holding the codes, in network.scoring.ITEM_FEATURES order
+CODE_COLUMNS = ["type_code", "color_code", "material_code", "size_code", "style_code", "special_property_code"]
+
+
+# wardrobe items as the DataFrame the inference expects
+def items_frame(items):
+    import pandas as pd
+    from network.scoring import ITEM_FEATURES
+
+    return pd.DataFrame(
+        [
+            {
+                "item_id": item.id,
+                "user_id": item.user_id,
+                "type": item.type,
+                "color": item.color,
+                "material": item.material,
+                "size": item.size,
+                "style": item.style,
+                "favorite": item.favorite,
+                "special_property": item.special_property,
+            }
+            for item in items
+        ],
+        columns=["item_id", "user_id", "type"] + [c for c in ITEM_FEATURES if c != "type"] + ["favorite"],
+    )
+
+
+# category codes of wardrobe items as {item_id: (slot, codes)}
+# items the vocabulary cannot encode (a value it has never seen, in a column without a
+# "missing" category) are skipped with a warning instead of failing the others
+def encode_codes(vocab, items):
+    from network.inference import encode_item_codes
+
+    try:
+        return encode_item_codes(vocab, items_frame(items))
+    except ValueError:
+        codes = {}
+        for item in items:
+            try:
+                codes.update(encode_item_codes(vocab, items_frame([item])))
+            except ValueError as e:
+                print(f"Warning: item {item.id} cannot be encoded with vocabulary {vocab.version}: {e}")
+        return codes
+
+
+# encode wardrobe items with the model vocabulary and store (or replace) their codes
+# written as an upsert, so concurrent writers of the same item's codes do not conflict
+# the caller commits the session
+def store_item_codes(db: Session, vocab, items):
+    if not items:
+        return {}
+    codes = encode_codes(vocab, items)
+    if codes:
+        upsert = insert(WardrobeItemCodeDB)
+        db.execute(
+            upsert.on_conflict_do_update(index_elements=["item_id", "vocab_version"],
+                                         set_={c: upsert.excluded[c] for c in ["slot"] + CODE_COLUMNS}),
+            [{"item_id": item_id, "vocab_version": vocab.version, "slot": slot, **dict(zip(CODE_COLUMNS, item_codes))}
+             for item_id, (slot, item_codes) in codes.items()],
+        )
+    return codes
+
+
+# encoded wardrobe of a user read from the stored codes of the current vocabulary
+# items that have no codes yet (e.g. written before the model was deployed) are encoded
+# and stored on the way
+def load_encoded_wardrobe(db: Session, vocab, user_id: int):
+    from network.inference import SLOT_TYPES, encoded_from_codes
+
+    # item types (lower case) that belong to some outfit slot and therefore get codes
+    outfit_types = [t for types in SLOT_TYPES.values() for t in types]
+    items = db.query(WardrobeItemDB).filter(WardrobeItemDB.user_id == user_id).order_by(WardrobeItemDB.id).all()
+    stored = {
+        row.item_id: (row.slot, [getattr(row, c) for c in CODE_COLUMNS])
+        for row in db.query(WardrobeItemCodeDB)
+        .join(WardrobeItemDB, WardrobeItemDB.id == WardrobeItemCodeDB.item_id)
+        .filter(WardrobeItemDB.user_id == user_id, WardrobeItemCodeDB.vocab_version == vocab.version)
+    }
+
+    missing = [item for item in items if item.id not in stored and (item.type or "").lower() in outfit_types]
+    if missing:
+        stored.update(store_item_codes(db, vocab, missing))
+        db.commit()
+
+    rows = [
+        {"item_id": item.id, "type": item.type, "favorite": item.favorite,
+         "slot": stored[item.id][0], "codes": stored[item.id][1]}
+        for item in items if item.id in stored
+    ]
+    return encoded_from_codes(rows, user_id)
+
+
+# remove the stored codes of an item (all vocabulary versions)
+def delete_item_codes(db: Session, item_id: int):
+    db.query(WardrobeItemCodeDB).filter(WardrobeItemCodeDB.item_id == item_id).delete()
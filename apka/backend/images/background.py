@@ -0,0 +1,57 @@
+import os
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# rembg model, e.g. "u2net", "isnet-general-use", "birefnet-general" (None: rembg's default)
+MODEL = None
+# Longer edge (pixels) uploads are downscaled to before segmentation (None: full size)
+MAX_EDGE = 1024
+
+
+    # rembg session (an onnxruntime model loaded in memory) of a background removal process.
+    # - Created once and reused by every upload the process segments, instead of rembg
+    #   loading the model again for every call without a session
+    # - Uses threads onnxruntime threads (default: cpu_count); the pipeline divides the
+    #   cores among its processes
+
+class BackgroundSession:
+    def __init__(self, model=MODEL, threads=None):
+        import onnxruntime as ort
+        from rembg import new_session
+
+        self.model = model
+        self.threads = threads or os.cpu_count()
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        if model is None:
+            self.session = new_session(sess_opts=options)
+        else:
+            self.session = new_session(model, sess_opts=options)
+
+    # Cut out the foreground of an image (PIL image in, RGBA PIL image out)
+    def remove(self, img):
+        from rembg import remove
+
+        return remove(img, session=self.session)
+
+
+# Uploaded image, upright (EXIF orientation applied) and downscaled so that its longer
+# edge is at most max_edge; JPEGs are decoded at reduced scale right away (draft), so a
+# 12 MP photo is never held in memory at full size
+def load_image(path, max_edge=MAX_EDGE):
+    try:
+        img = Image.open(path)
+    except UnidentifiedImageError:
+        raise ValueError("Uploaded file is not a supported image")
+    if max_edge:
+        img.draft("RGB", (max_edge, max_edge))
+    img = ImageOps.exif_transpose(img)
+    if max_edge:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return img
+
+
+# Cut out the foreground of the image at source and save it as a PNG to path
+def remove_background(session, source, path, max_edge=MAX_EDGE):
+    output = session.remove(load_image(source, max_edge))
+    output.save(path, format="PNG")
@@ -0,0 +1,42 @@
+import os
+import uuid
+
+# PIL is imported in make_derivative, so main can import this module without it
+
+# Longer edge (pixels) of the WebP derivatives made of every uploaded image
+SIZES = (128, 512)
+WEBP_QUALITY = 80
+
+
+# Path of an image's derivative: <derivatives_dir>/<size>/<name>.webp
+def derivative_path(derivatives_dir, filename, size):
+    return os.path.join(derivatives_dir, str(size), os.path.splitext(filename)[0] + ".webp")
+
+
+# Downscaled WebP copy of the image at source (alpha kept); returns its path
+def make_derivative(source, derivatives_dir, size, quality=WEBP_QUALITY):
+    from PIL import Image, ImageOps
+
+    path = derivative_path(derivatives_dir, os.path.basename(source), size)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        alpha = "A" in img.getbands() or "transparency" in img.info
+        img = img.convert("RGBA" if alpha else "RGB")
+        img.thumbnail((size, size), Image.LANCZOS)
+        # written under a unique name first, so concurrent requests never serve half a file
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        img.save(tmp_path, format="WEBP", quality=quality, method=4)
+    os.replace(tmp_path, path)
+    return path
+
+
+def make_derivatives(source, derivatives_dir, sizes=SIZES):
+    return [make_derivative(source, derivatives_dir, size) for size in sizes]
+
+
+def delete_derivatives(filename, derivatives_dir, sizes=SIZES):
+    for size in sizes:
+        path = derivative_path(derivatives_dir, filename, size)
+        if os.path.exists(path):
+            os.remove(path)
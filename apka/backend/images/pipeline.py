@@ -0,0 +1,182 @@
+import json
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from .background import MAX_EDGE, MODEL
+
+# Worker processes segmenting images at the same time
+PROCESSES = os.cpu_count()
+# Uploads accepted at once (running and waiting); more are rejected until one finishes
+MAX_PENDING = 2 * PROCESSES
+# Seconds a finished job's record is kept for polling
+JOB_TTL = 3600
+
+# BackgroundSession of a worker process, created by _init_worker
+_session = None
+
+
+def _init_worker(model, threads):
+    global _session
+    from .background import BackgroundSession
+
+    _session = BackgroundSession(model, threads=threads)
+
+
+def _ready():
+    return os.getpid()
+
+
+# Path an upload is kept under next to its cut-out: <name>.original<ext of the upload>
+def original_path(source, path):
+    return os.path.splitext(path)[0] + ".original" + os.path.splitext(source)[1]
+
+
+# Segment the uploaded file at source and write the cut-out PNG to path (in a worker process),
+# then its WebP derivatives if derivatives_dir is set
+# source is moved to original afterwards if set, deleted otherwise
+# uploads of the same photo may run at once (e.g. in several server workers): each writes
+# its own temporary file and the renames to path and original are atomic
+def _remove_to_file(source, path, max_edge, original, derivatives_dir):
+    from .background import remove_background
+    from .derivatives import make_derivatives
+
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        remove_background(_session, source, tmp_path, max_edge)
+        os.replace(tmp_path, path)
+        if derivatives_dir is not None:
+            make_derivatives(path, derivatives_dir)
+        if original is not None:
+            os.replace(source, original)
+    finally:
+        for leftover in (tmp_path, source):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return path
+
+
+def job_path(jobs_dir, job_id):
+    return os.path.join(jobs_dir, f"{job_id}.json")
+
+
+# Record of a job started by BackgroundRemoval.watch, or None for unknown (or expired) ids
+# (reads only the jobs directory, so polls do not need the worker processes)
+def read_job(jobs_dir, job_id):
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+        return None
+    try:
+        with open(job_path(jobs_dir, job_id)) as f:
+            return {"job_id": job_id, **json.load(f)}
+    except FileNotFoundError:
+        return None
+
+
+    # Background removal off the event loop, in a bounded pool of worker processes.
+    # - Every process keeps its own rembg session, loaded when the process starts
+    #   (spawned, so it does not inherit the server's threads or the recommender)
+    # - Workers read the upload from disk and downscale it to max_edge before segmenting;
+    #   the upload is deleted afterwards, or kept next to the cut-out (original_path) if
+    #   keep_originals
+    # - The 128 and 512 px WebP derivatives of the cut-out are made right after it, in
+    #   derivatives_dir (if set)
+    # - At most max_pending uploads are accepted at once; submit() raises queue.Full
+    #   beyond that, so a burst of uploads is turned away instead of queueing unbounded
+    # - submit() returns a concurrent future of the cut-out, which the event loop can await
+    #   (asyncio.wrap_future) and concurrent uploads of the same photo can share
+    # - watch() turns such a future into a job: the job's record (pending / done / failed,
+    #   url of the cut-out) is a JSON file in jobs_dir, so any server worker can answer
+    #   polls (read_job)
+
+class BackgroundRemoval:
+    def __init__(self, jobs_dir, model=MODEL, processes=PROCESSES, max_pending=MAX_PENDING, job_ttl=JOB_TTL,
+                 threads=None, max_edge=MAX_EDGE, keep_originals=False, derivatives_dir=None):
+        self.jobs_dir = jobs_dir
+        self.derivatives_dir = derivatives_dir
+        self.max_edge = max_edge
+        self.keep_originals = keep_originals
+        self.processes = max(1, processes)
+        self.max_pending = max(1, max_pending)
+        self.job_ttl = job_ttl
+        os.makedirs(jobs_dir, exist_ok=True)
+
+        # onnxruntime threads per process (default: the cores shared among the processes)
+        threads = threads or max(1, os.cpu_count() // self.processes)
+        self.executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_worker, initargs=(model, threads))
+        self.pending = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        # start one worker (loading its model), so a broken setup fails here
+        self.executor.submit(_ready).result()
+
+    # Start segmenting the upload at source; the future's result is path
+    def submit(self, source, path):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise queue.Full(f"{self.pending} uploads are already being processed")
+            self.pending += 1
+        try:
+            original = original_path(source, path) if self.keep_originals else None
+            future = self.executor.submit(_remove_to_file, source, path, self.max_edge, original,
+                                          self.derivatives_dir)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    # Job for a future of submit() (possibly shared by several uploads of the same photo);
+    # read_job reports url once the cut-out is written
+    def watch(self, future, url):
+        self._expire()
+        job_id = uuid.uuid4().hex
+        self._write_job(job_id, {"status": "pending", "url": None, "error": None})
+        future.add_done_callback(lambda f: self._finish(job_id, url, f))
+        return job_id
+
+    def stats(self):
+        with self.lock:
+            return {"processes": self.processes, "max_pending": self.max_pending, "pending": self.pending,
+                    "rejected": self.rejected}
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self):
+        with self.lock:
+            self.pending -= 1
+
+    def _finish(self, job_id, url, future):
+        if future.cancelled():
+            record = {"status": "failed", "url": None, "error": "cancelled"}
+        elif future.exception() is not None:
+            e = future.exception()
+            record = {"status": "failed", "url": None, "error": f"{type(e).__name__}: {e}"}
+        else:
+            record = {"status": "done", "url": url, "error": None}
+        self._write_job(job_id, record)
+
+    def _job_path(self, job_id):
+        return job_path(self.jobs_dir, job_id)
+
+    def _write_job(self, job_id, record):
+        path = self._job_path(job_id)
+        with open(path + ".part", "w") as f:
+            json.dump(record, f)
+        os.replace(path + ".part", path)
+
+    # Remove job records older than job_ttl
+    def _expire(self):
+        cutoff = time.time() - self.job_ttl
+        for entry in os.scandir(self.jobs_dir):
+            if entry.name.endswith(".json") and entry.stat().st_mtime < cutoff:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
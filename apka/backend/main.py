@@ -1,27 +1,140 @@
+import time
+IMPORT_START = time.perf_counter()
+import asyncio
+import glob
+import hashlib
 import os
+import queue
 import uvicorn
-from fastapi import FastAPI, HTTPException, Body, Depends, Query, Path, File, UploadFile
+from fastapi import FastAPI, HTTPException, Body, Depends, Query, Path, File, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, Response
 from pydantic import BaseModel, Field
 from typing import List
-import pandas as pd
-from weather.weather import fetch_weather
+from weather import weather as weather_api
 from sqlalchemy.orm import Session
-from database.db_engine import SessionLocal
+from database.db_engine import Base, SessionLocal, engine
 from database.db_schema import WardrobeItemDB, UserDB
+from database.item_codes import delete_item_codes, load_encoded_wardrobe, store_item_codes
 from fastapi.staticfiles import StaticFiles
 from typing import Optional
 import uuid
-from network.inference import load_model, recommend_outfits
-from rembg import remove
-from PIL import Image
+from subsystems import LazySubsystem
+from images.derivatives import SIZES as DERIVATIVE_SIZES, delete_derivatives, derivative_path, make_derivative
+
+# the recommender (torch, pandas, sklearn) and background removal (rembg, onnxruntime)
+# are imported when they are loaded, not here; see LazySubsystem below
+# startup-phase timings in seconds, reported by /readyz
+startup_timings = {"imports": time.perf_counter() - IMPORT_START}
 
 # directory where images are stored
 UPLOAD_DIR = "uploads"
 
+# checkpoint served at startup (its vocabulary is built from TRAINING_CSV if missing)
+MODEL_PATH = "network/final30.pth"
+# directory of the checkpoints /admin/models may load (paths are relative to it)
+MODELS_DIR = "network"
+# allow loading, activating and rolling back versions through /admin/models; serve.py turns
+# it off with more than one worker, since a request only changes the worker that handles it
+ADMIN_MODEL_WRITES = True
+TRAINING_CSV = "network/data/scored_data/out/training_topOuter_clean.csv"
+
+# served model: "eager", "torchscript" or "quantized" (exported with network/export.py)
+MODEL_VARIANT = "eager"
+# serve the distilled student (python -m network.train.distill) instead of RecommenderNet
+SERVE_STUDENT = False
+
+# micro-batching of concurrent recommendation requests
+BATCH_WINDOW = 0.002  # seconds a batch waits for more requests
+MAX_BATCH_SIZE = 8192  # outfit combinations per forward pass
+
+# cache of recommendation lists (wardrobe fingerprint + weather rounded to buckets)
+CACHE_SIZE = 1024  # cached recommendation lists
+CACHE_TTL = 600  # seconds
+WEATHER_BUCKETS = {"temperature": 0.5, "rain": 5.0, "wind": 1.0}  # degrees C, % rain, m/s wind
+# users whose encoded wardrobe (from the stored item codes) is kept for /users/{id}/recommend
+# (0: read the codes every time; serve.py sets it with more than one worker, since an item
+# write only invalidates the cache of the worker that handles it)
+ENCODED_CACHE_SIZE = 1024
+
+# rule-based pre-ranking for huge wardrobes: only the best CASCADE_SIZE combinations by
+# rule score are scored by the model (None = score all; recall report: python -m network.cascade)
+CASCADE_SIZE = None
+# beam search over outfit pieces for three-piece outfits: keeps the best BEAM_WIDTH
+# pairs between steps (None = score the full product; benchmark: python -m network.beam)
+BEAM_WIDTH = None
+
+# load the recommender in the background as soon as the server starts (otherwise on
+# the first request that needs it), and how long such a request waits for it
+WARMUP_RECOMMENDER = True
+RECOMMENDER_WAIT = 60  # seconds
+# load background removal at startup too (otherwise on the first upload)
+WARMUP_BACKGROUND_REMOVAL = False
+# rembg model used for background removal (None: rembg's default)
+BACKGROUND_MODEL = None
+# worker processes segmenting uploads at the same time, and uploads accepted at once
+# (running and waiting) before further ones get a 503; serve.py divides them among its
+# workers, so all server processes together start about one per core
+BACKGROUND_PROCESSES = os.cpu_count()
+BACKGROUND_MAX_PENDING = 2 * BACKGROUND_PROCESSES
+# onnxruntime threads of every background removal process (None: cores / processes)
+BACKGROUND_THREADS = None
+# uploads above MAX_UPLOAD_BYTES are rejected (413): request bodies larger than that (plus
+# the multipart framing) before they are received, smaller ones when their image is copied
+# from Starlette's spooled form file to uploads/ in chunks
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+# longer edge (pixels) photos are downscaled to before background removal (None: full size)
+MAX_IMAGE_EDGE = 1024
+# keep the uploaded original ({hash}.original{ext}) next to its cut-out ({hash}.png)
+KEEP_ORIGINALS = False
+# downscaled WebP copies of uploaded images, served by /images/{filename}?size=
+DERIVATIVES_DIR = os.path.join(UPLOAD_DIR, "derivatives")
+# records of asynchronous uploads (?asynchronous=true), polled at /upload_image/jobs/{job_id}
+JOBS_DIR = "upload_jobs"
+
 # create fastAPI application
 app = FastAPI()
 
+    # Rejects request bodies of the given paths above max_bytes with a 413 before they are parsed.
+    # - A Content-Length above max_bytes is answered at once, without reading the body
+    # - Bodies without a Content-Length (chunked) are counted while they are received and
+    #   cut off once they exceed max_bytes
+    # FastAPI reads the whole form (spooling file fields to temporary files) before the
+    # endpoint runs, so an endpoint alone cannot turn away an oversized upload early.
+
+class BodySizeLimit:
+    def __init__(self, app, paths, max_bytes):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        detail = f"Request body is larger than {self.max_bytes} bytes"
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            return await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# added before CORS, so CORS headers are added to its 413 responses too
+app.add_middleware(BodySizeLimit, paths=["/upload_image"], max_bytes=MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES)
+
 # enable all origins to access this app
 app.add_middleware(
     CORSMiddleware,
@@ -31,8 +144,77 @@ app.add_middleware(
 )
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
-# load the model and dataset
-model, dataset = load_model("network/final30.pth", "network/data/scored_data/out/training_topOuter_clean.csv")
+# the recommender: registry of loaded model versions; every version has its own
+#   - inference worker, so concurrent recommendation requests share forward passes
+#   - cache of recommendation lists (unchanged wardrobe and similar weather)
+#   - cache of encoded wardrobes of users recommended straight from the database
+#   - index of scored outfit combinations, updated incrementally when items change
+# new checkpoints are loaded and swapped in at runtime through the /admin/models endpoints
+def load_recommender():
+    from network.inference import load_model
+    from network.registry import ModelRegistry
+
+    registry = ModelRegistry(
+        lambda path, **options: load_model(path, TRAINING_CSV, **options),
+        window=BATCH_WINDOW, max_batch_size=MAX_BATCH_SIZE,
+        cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL, buckets=WEATHER_BUCKETS, top_m=CASCADE_SIZE,
+        beam_width=BEAM_WIDTH, encoded_cache_size=ENCODED_CACHE_SIZE,
+    )
+    registry.load_now(MODEL_PATH, variant=MODEL_VARIANT, student=SERVE_STUDENT)
+    return registry
+
+recommender = LazySubsystem("recommender", load_recommender)
+
+# background removal: pool of worker processes, each with its own rembg session
+def load_background_removal():
+    from images.pipeline import BackgroundRemoval
+
+    return BackgroundRemoval(JOBS_DIR, BACKGROUND_MODEL, BACKGROUND_PROCESSES, BACKGROUND_MAX_PENDING,
+                             threads=BACKGROUND_THREADS, max_edge=MAX_IMAGE_EDGE, keep_originals=KEEP_ORIGINALS,
+                             derivatives_dir=DERIVATIVES_DIR)
+
+# background removal for a request; 503 if it failed to load
+def background_pipeline():
+    try:
+        return background_removal.get()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+background_removal = LazySubsystem("background_removal", load_background_removal)
+
+# cut-outs being made, by content hash: concurrent uploads of the same photo (synchronous
+# or not) share the one submitted first instead of writing the same files at once
+cutouts_in_progress = {}
+
+# model registry for a request; 503 while the recommender is loading or if it failed
+def model_registry():
+    try:
+        return recommender.get(timeout=RECOMMENDER_WAIT)
+    except (TimeoutError, RuntimeError) as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@app.on_event("startup")
+def warm_up():
+    if WARMUP_RECOMMENDER:
+        recommender.start()
+    if WARMUP_BACKGROUND_REMOVAL:
+        background_removal.start()
+
+@app.on_event("shutdown")
+def stop_scheduler():
+    if recommender.loaded():
+        recommender.value.close()
+    if background_removal.loaded():
+        background_removal.value.close()
+
+@app.on_event("shutdown")
+async def close_weather_client():
+    await weather_api.client.close()
+
+# create tables added since the database was initialized (e.g. wardrobe_item_codes)
+start = time.perf_counter()
+Base.metadata.create_all(bind=engine)
+startup_timings["database"] = time.perf_counter() - start
 
 # create database session
 def get_db():
@@ -93,46 +275,224 @@ class RecommendRequest(BaseModel):
     weather: Weather
     user_id: int
 
+# one day of the forecast returned by /api/weather
+class ForecastDay(Weather):
+    time: Optional[str] = None
+
+# input for generating outfit recommendations for every day of a forecast
+class ForecastRecommendRequest(BaseModel):
+    wardrobe: List[Item]
+    forecast: List[ForecastDay]
+    user_id: int
+    top_k: int = Field(5, ge=1)
+
+# input for generating outfit recommendations for many users at once
+class BatchRecommendRequest(BaseModel):
+    requests: List[RecommendRequest]
+    top_k: int = Field(5, ge=1)
+
+# checkpoint to load as a new model version
+class LoadModelRequest(BaseModel):
+    path: str  # relative to MODELS_DIR
+    variant: str = "eager"
+    student: bool = False
+    activate: bool = True
+
 # =============
 # FastAPI CRUDs
 # =============
+# convert the wardrobe sent by the client to the DataFrame the inference expects
+def wardrobe_frame(wardrobe: List[Item], user_id: int):
+    import pandas as pd
+
+    wardrobe_df = pd.DataFrame([item.dict() for item in wardrobe])
+    wardrobe_df["user_id"] = user_id  # single user
+    wardrobe_df.rename(columns={"id": "item_id"}, inplace=True)
+    return wardrobe_df
+
+# convert the weather sent by the client to the dictionary the inference expects
+def weather_dict(weather: Weather):
+    return {"temperature": weather.temperature, "rain": weather.rain_chance, "wind": weather.wind_speed}
+
 # get recommendations from users wardrobe
 @app.post("/recommend")
 def recommend(req: RecommendRequest):
-    # Convert to DataFrame like your inference expects
-    items = [
-        Item(
-            id=item.id,
-            type=item.type,
-            color=item.color,
-            material=item.material,
-            size=item.size,
-            style=item.style,
-            favorite=item.favorite,
-            special_property=item.special_property,
-        ) for item in req.wardrobe
-    ]
-    wardrobe_df = pd.DataFrame([item.dict() for item in items])
-    wardrobe_df["user_id"] = req.user_id  # single user
-    wardrobe_df.rename(columns={"id": "item_id"}, inplace=True)
-    weather = {"temperature": req.weather.temperature, "rain": req.weather.rain_chance, "wind": req.weather.wind_speed}
-    recs = recommend_outfits(model, dataset, wardrobe_df, user_id=req.user_id, weather=weather)
+    wardrobe_df = wardrobe_frame(req.wardrobe, req.user_id)
+    weather = weather_dict(req.weather)
+    top_k = 5
+    served = model_registry().active
+    recs = served.recommendation_cache.get_or_compute(
+        req.user_id, wardrobe_df, weather, top_k,
+        lambda: served.outfit_index.recommend(req.user_id, wardrobe_df, weather, top_k=top_k)
+    )
     return {"recommendations": recs}
 
+# get recommendations for a user from the wardrobe stored in the database
+# items are read as the category codes stored at write time, and the encoded
+# wardrobe is cached per user until one of their items changes
+@app.post("/users/{user_id}/recommend")
+def recommend_for_user(user_id: int = Path(...), weather: Weather = Body(...), db: Session = Depends(get_db)):
+    from network.inference import recommend_encoded
+
+    served = model_registry().active
+    encoded = served.encoded_wardrobes.get(user_id, lambda: load_encoded_wardrobe(db, served.vocab, user_id))
+    recs = recommend_encoded(served.scheduler, served.vocab, encoded, user_id, weather_dict(weather),
+                             top_m=CASCADE_SIZE, beam_width=BEAM_WIDTH)
+    return {"recommendations": recs}
+
+# get recommendations for many users at once (e.g. the morning push job)
+# outfits of all users are scored in shared model batches
+@app.post("/recommend/batch")
+def recommend_batch(req: BatchRecommendRequest):
+    requests = [
+        {"user_id": r.user_id, "wardrobe": wardrobe_frame(r.wardrobe, r.user_id), "weather": weather_dict(r.weather)}
+        for r in req.requests
+    ]
+    from network.inference import recommend_outfits_batch
+
+    served = model_registry().active
+    results = recommend_outfits_batch(served.scheduler, served.vocab, requests, top_k=req.top_k,
+                                      top_m=CASCADE_SIZE, beam_width=BEAM_WIDTH)
+    return {
+        "results": [
+            {"user_id": r.user_id, "recommendations": recs} for r, recs in zip(req.requests, results)
+        ]
+    }
+
+# get recommendations for every day of a weather forecast (e.g. to plan a week)
+# the wardrobe is encoded once and all days are scored in shared model batches
+@app.post("/recommend/forecast")
+def recommend_forecast(req: ForecastRecommendRequest):
+    wardrobe_df = wardrobe_frame(req.wardrobe, req.user_id)
+    forecast = [weather_dict(day) for day in req.forecast]
+    from network.inference import recommend_outfits_forecast
+
+    served = model_registry().active
+    results = recommend_outfits_forecast(served.scheduler, served.vocab, wardrobe_df, req.user_id, forecast, top_k=req.top_k,
+                                         top_m=CASCADE_SIZE, beam_width=BEAM_WIDTH)
+    return {
+        "forecast": [
+            {"time": day.time, "recommendations": recs} for day, recs in zip(req.forecast, results)
+        ]
+    }
+
+
+# liveness: the server process is up and answering requests
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+# readiness: 200 once the recommender is loaded, 503 while it is loading or if it failed
+# also reports the startup-phase timings and the state of every lazily loaded subsystem
+@app.get("/readyz")
+def readyz():
+    subsystems = {s.name: s.status() for s in (recommender, background_removal)}
+    timings = {**startup_timings, "recommender": recommender.seconds}
+    body = {"ready": recommender.loaded(), "startup_timings": timings, "subsystems": subsystems}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+# queue depth and batch-size statistics of the inference worker
+@app.get("/stats/inference")
+def inference_stats():
+    return model_registry().active.scheduler.stats()
+
+# hit/miss counters of the recommendation and encoded wardrobe caches
+@app.get("/stats/cache")
+def cache_stats():
+    served = model_registry().active
+    return {
+        "recommendations": served.recommendation_cache.stats(),
+        "encoded_wardrobes": served.encoded_wardrobes.stats(),
+    }
+
+# worker processes and accepted, running and rejected uploads of background removal
+@app.get("/stats/background")
+def background_stats():
+    if not background_removal.loaded():
+        return background_removal.status()
+    return background_removal.value.stats()
+
+# cached cities and forecasts and upstream requests of the weather client
+@app.get("/stats/weather")
+def weather_stats():
+    return weather_api.client.stats()
+
+# list loaded model versions (status, checkpoint, vocabulary, load and warm-up times)
+@app.get("/admin/models")
+def list_models():
+    return model_registry().list()
+
+# 409 for /admin/models writes when they are off (multi-worker serve.py)
+def check_admin_model_writes():
+    if not ADMIN_MODEL_WRITES:
+        raise HTTPException(status_code=409, detail="model versions cannot be changed at runtime with several "
+                                                    "workers; set MODEL_PATH and restart the server")
+
+# load a checkpoint in the background; it is warmed up and, if activate is set,
+# swapped in once ready (poll GET /admin/models for its status)
+@app.post("/admin/models", status_code=202)
+def load_model_version(req: LoadModelRequest):
+    check_admin_model_writes()
+    models_dir = os.path.realpath(MODELS_DIR)
+    path = os.path.realpath(os.path.join(models_dir, req.path))
+    if os.path.commonpath([models_dir, path]) != models_dir or not path.endswith(".pth"):
+        raise HTTPException(status_code=400, detail=f"path must be a .pth checkpoint inside {MODELS_DIR}")
+    name = model_registry().load(path, activate=req.activate, variant=req.variant, student=req.student)
+    return {"name": name, "status": "loading"}
+
+# make a loaded version the active one
+@app.post("/admin/models/{name}/activate")
+def activate_model_version(name: str = Path(...)):
+    check_admin_model_writes()
+    registry = model_registry()
+    try:
+        registry.activate(name)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return registry.list()
+
+# re-activate the previously active version
+@app.post("/admin/models/rollback")
+def rollback_model_version():
+    check_admin_model_writes()
+    registry = model_registry()
+    try:
+        registry.rollback()
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return registry.list()
+
+
 
 # get full 7-day weather forecast for the given city
 @app.post("/api/weather")
 async def weather(req: WeatherRequest = Body(...)):
-    return fetch_weather(req.city, req.long_term)
+    return await weather_api.fetch_weather(req.city, req.long_term)
 
 
 # add new item to the wardrobe_items table with the link to the given user
+# (a sync endpoint: updating the outfit index runs forward passes, which must not block the event loop)
 @app.post("/add_item")
-async def add_item(item: WardrobeItem = Body(...), user_id: int = Query(...), db: Session = Depends(get_db)):
+def add_item(item: WardrobeItem = Body(...), user_id: int = Query(...), db: Session = Depends(get_db)):
     db_item = WardrobeItemDB(**item.dict(), user_id=user_id)
     db.add(db_item)
+    db.flush()
+    # store the model's category codes in the same commit, so recommendations do not re-encode the item
+    # (items added before the recommender is loaded get their codes on the first recommendation)
+    registry = recommender.value if recommender.loaded() else None
+    served = registry.active if registry is not None else None
+    codes = store_item_codes(db, served.vocab, [db_item]) if served is not None else {}
     db.commit()
     db.refresh(db_item)
+    if served is not None:
+        registry.invalidate_user(user_id)
+        if db_item.id in codes:
+            served.outfit_index.add_item(user_id, {"item_id": db_item.id, **item.dict()})
+        else:
+            # not an outfit piece, or values the vocabulary cannot encode: rebuilt on the next read
+            served.outfit_index.invalidate_user(user_id)
     return {"message": "Item saved", "item_id": db_item.id}
 
 # add new user to the users table
@@ -170,15 +530,25 @@ async def get_user(user_id: int = Path(...), db: Session = Depends(get_db)):
     }
 
 
+# True if another wardrobe item uses the image of item
+def image_shared(db: Session, item: WardrobeItemDB):
+    file_name = item.image_url.split('/')[-1]
+    return db.query(WardrobeItemDB).filter(
+        WardrobeItemDB.id != item.id,
+        WardrobeItemDB.image_url.endswith(f"/{file_name}", autoescape=True) | (WardrobeItemDB.image_url == file_name),
+    ).first() is not None
+
 # delete an item from wardrobe_items table (if image is linked to this item, delete it as well)
+# (a sync endpoint, like add_item: removing an item may rebuild outfit index buckets)
 @app.delete("/delete_item/{item_id}")
-async def delete_item(item_id: int = Path(..., description="ID of the item to delete"), 
+def delete_item(item_id: int = Path(..., description="ID of the item to delete"), 
                       db: Session = Depends(get_db)):
     db_item = db.query(WardrobeItemDB).filter(WardrobeItemDB.id == item_id).first()
     if not db_item:
         raise HTTPException(status_code=404, detail="Item not found")
     
-    if db_item.image_url:
+    # images are shared by items uploaded from the same photo; the file is removed with its last item
+    if db_item.image_url and not image_shared(db, db_item):
         file_name = db_item.image_url.split('/')[-1]
         file_path = os.path.join(UPLOAD_DIR, file_name)
         if os.path.exists(file_path):
@@ -189,9 +559,18 @@ async def delete_item(item_id: int = Path(..., description="ID of the item to de
         # Optional: log if file was missing
         else:
             print(f"Warning: Image file not found for item {item_id}")
+        delete_derivatives(file_name, DERIVATIVES_DIR, DERIVATIVE_SIZES)
+        # the upload it was cut out of, kept with KEEP_ORIGINALS ({hash}.original{ext})
+        root = os.path.splitext(file_name)[0]
+        for original_path in glob.glob(os.path.join(UPLOAD_DIR, glob.escape(root) + ".original.*")):
+            os.remove(original_path)
     
+    delete_item_codes(db, item_id)
     db.delete(db_item)
     db.commit()
+    if recommender.loaded():
+        recommender.value.invalidate_user(db_item.user_id)
+        recommender.value.active.outfit_index.remove_item(db_item.user_id, item_id)
     
     return {"message": f"Item {item_id} deleted successfully"}
 
@@ -213,43 +592,142 @@ async def get_wardrobe(user_id: int = Query(..., description="User ID"), db: Ses
                 "favorite": item.favorite,
                 "special_property": item.special_property,
                 "category": item.category,
-                "image_url": item.image_url
+                "image_url": item.image_url,
+                "thumbnail_url": thumbnail_url(item.image_url),
             }
             for item in items
         ]
     }
 
+# url of the smallest derivative of an uploaded image (for wardrobe grids)
+def thumbnail_url(image_url: Optional[str]):
+    if not image_url:
+        return None
+    return f"http://localhost:8000/images/{image_url.split('/')[-1]}?size={min(DERIVATIVE_SIZES)}"
+
+# copy an upload (already received and spooled by Starlette, see BodySizeLimit) to path
+# chunk by chunk and return the hash of its content
+# 413 (and nothing written) above MAX_UPLOAD_BYTES
+async def save_upload(file: UploadFile, path: str):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "wb") as f:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    if size > MAX_UPLOAD_BYTES:
+        os.remove(path)
+        raise HTTPException(status_code=413, detail=f"Image is larger than {MAX_UPLOAD_BYTES} bytes")
+    return digest.hexdigest()
+
 # transfer images from frontend to backend and save it in "uploads/"
+# images are stored under the hash of the uploaded bytes, so a photo uploaded again is
+# answered at once with the existing cut-out, without background removal
+# background removal runs in a worker process, so the event loop keeps serving other requests
+# uploads of a photo whose cut-out is being made wait for that one
+# asynchronous=true returns a job id at once (202); poll /upload_image/jobs/{job_id} for the url
 @app.post("/upload_image")
-async def upload_image(file: UploadFile = File(...)):
-    
-    # Generate a unique filename
-    filename = f"{uuid.uuid4()}_{file.filename}"
-    file_path = os.path.join(UPLOAD_DIR, filename)
-
-    # Save file to disk
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
-    
-    # remove background
-    img = Image.open(file_path)
-    output = remove(img)
-
-    # detect output format from file extension
-    root, ext = os.path.splitext(file_path)
-    ext = ext.lower()
+async def upload_image(file: UploadFile = File(...), asynchronous: bool = Query(False)):
+    # Save file to disk in chunks (the worker process reads and then deletes it)
+    ext = os.path.splitext(os.path.basename(file.filename))[1]
+    upload_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}.upload{ext}")
+    content_hash = await save_upload(file, upload_path)
+
+    # content-addressed filename, always png to have clear background
+    root = content_hash[:32]
+    new_filename = root + ".png"
+    new_path = os.path.join(UPLOAD_DIR, new_filename)
+    url = f"http://localhost:8000/uploads/{new_filename}"
+    if root not in cutouts_in_progress and os.path.exists(new_path):
+        os.remove(upload_path)
+        return {"filename": new_filename, "url": url}
 
-    # change to png to have clear background
-    if ext in [".jpg", ".jpeg"]:
-        new_path = root + ".png"
+    try:
+        # loading starts worker processes and the rembg model, so it does not run on the event loop
+        pipeline = await run_in_threadpool(background_pipeline)
+    except HTTPException:
+        os.remove(upload_path)
+        raise
+
+    cutout = cutouts_in_progress.get(root)
+    if cutout is not None:
+        os.remove(upload_path)
     else:
-        new_path = file_path
-
-    new_filename = os.path.basename(new_path)
-    output.save(new_path)
-    os.remove(file_path)
-
-    return {"filename": new_filename, "url": f"http://localhost:8000/uploads/{new_filename}"}
+        try:
+            cutout = pipeline.submit(upload_path, new_path)
+        except queue.Full as e:
+            os.remove(upload_path)
+            raise HTTPException(status_code=503, detail=f"Too many uploads in progress: {e}",
+                                headers={"Retry-After": "5"})
+        cutouts_in_progress[root] = cutout
+        asyncio.wrap_future(cutout).add_done_callback(lambda _: cutouts_in_progress.pop(root, None))
+
+    if asynchronous:
+        job_id = pipeline.watch(cutout, url)
+        return JSONResponse({"job_id": job_id, "status_url": f"/upload_image/jobs/{job_id}"}, status_code=202)
+    try:
+        # shield: a client that disconnects does not cancel the cut-out other uploads wait for
+        await asyncio.shield(asyncio.wrap_future(cutout))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {"filename": new_filename, "url": url}
+
+# state of an asynchronous upload: pending, done (with the url of the cut-out) or failed
+@app.get("/upload_image/jobs/{job_id}")
+def upload_job(job_id: str = Path(...)):
+    from images.pipeline import read_job
+
+    job = read_job(JOBS_DIR, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+# whether an If-None-Match header (a list of entity tags, weak ones with W/, or *) matches etag
+# (If-None-Match uses the weak comparison: W/"x" matches "x")
+def etag_matches(if_none_match: Optional[str], etag: str):
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+# uploaded image at a given size: 128 or 512 (WebP derivative) or "original"
+# derivatives of images uploaded before they existed are made on the first request
+# a file name always stands for the same content, so responses are cacheable forever (immutable), and
+# the ETag is derived from the name, size and byte length: the same in every server worker, and
+# for a derivative made again after the image was deleted and uploaded again
+@app.get("/images/{filename}")
+def get_image(request: Request, filename: str = Path(...), size: str = Query(str(min(DERIVATIVE_SIZES)))):
+    source = os.path.join(UPLOAD_DIR, filename)
+    if filename != os.path.basename(filename) or filename.startswith(".") or not os.path.isfile(source):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    if size == "original":
+        path = source
+    elif size.isdigit() and int(size) in DERIVATIVE_SIZES:
+        path = derivative_path(DERIVATIVES_DIR, filename, int(size))
+        if not os.path.exists(path):
+            try:
+                make_derivative(source, DERIVATIVES_DIR, int(size))
+            except OSError as e:
+                raise HTTPException(status_code=415, detail=f"Could not read image: {e}")
+    else:
+        sizes = ", ".join(str(s) for s in DERIVATIVE_SIZES)
+        raise HTTPException(status_code=400, detail=f"size must be one of {sizes} or original")
+
+    stat = os.stat(path)
+    name_digest = hashlib.sha256(f"{filename}/{size}".encode()).hexdigest()[:32]
+    headers = {
+        "ETag": f'"{name_digest}-{stat.st_size:x}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers, stat_result=stat)
 
 
 
@@ -0,0 +1,151 @@
+# Beam-search assembly of three-piece outfits.
+# Instead of scoring the whole outer x top x bottom product, the search
+#   1. ranks top x bottom pairs without an outer,
+#   2. tries every outer for the best beam_width pairs,
+#   3. (symmetric) tries every bottom for the best beam_width (outer, top) pairs of step 2,
+# so the cost grows with beam_width * wardrobe size instead of its cube.
+# Benchmark against the exact search on growing wardrobes:
+#   python -m network.beam network/final_version.pth --merge 1 5 10 20
+
+import argparse
+import time
+import numpy as np
+import torch
+from .cascade import REPORT_DATASET, report_wardrobes, score_candidates
+from .scoring import CHUNK_SIZE, ForwardScorer, encode_slot, select_top_k, stream_top_k_packed
+
+# Pairs (and outer/top pairs) kept between the steps of the beam search
+BEAM_WIDTH = 16
+
+
+# Best k of several candidate lists, ties ranked in enumeration order like the exact search
+def _top_k_of(parts, k):
+    scores = torch.cat([s for s, _ in parts])
+    flat = torch.cat([f for _, f in parts])
+    order = torch.argsort(flat, stable=True)
+    scores, flat = scores[order], flat[order]
+    keep = select_top_k(scores, k)
+    return scores[keep], flat[keep]
+
+
+# Beam-search version of stream_top_k_packed for plans built by plan_outfits
+# scorer_cls is ForwardScorer or FactorizedScorer; every step scores the candidates of
+# all plans in shared model batches. Plans without an outer are pairs only, so their
+# first step already is the exact search.
+# Returns a list of (scores, flat indices) of the k best combinations, highest first
+def beam_top_k_packed(model, scorer_cls, plans, vocab, k, beam_width=BEAM_WIDTH, symmetric=True,
+                      chunk_size=CHUNK_SIZE):
+    width = max(k, beam_width)
+    scorers, pair_scorers, sizes = [], [], []
+    for plan in plans:
+        slots, weather = plan["slots"], plan["weather"]
+        scorers.append(scorer_cls(model, slots, weather, vocab, plan["has_outer"]))
+        # top x bottom pairs scored as two-piece outfits (outer "missing", has_outer=0)
+        pair_slots = dict(slots, outer=encode_slot(None, "outer", vocab))
+        pair_scorers.append(scorer_cls(model, pair_slots, weather, vocab, False) if plan["has_outer"] else scorers[-1])
+        sizes.append((len(slots["outer"][0]), len(slots["top"][0]), len(slots["bottom"][0])))
+
+    # 1. best pairs; flat pair index t * n_bottom + b is also the combination index with outer 0
+    pairs = stream_top_k_packed(pair_scorers, [n_top * n_bottom for _, n_top, n_bottom in sizes], width, chunk_size)
+
+    # 2. every outer for the best pairs
+    outer_plans = [i for i, plan in enumerate(plans) if plan["has_outer"]]
+    candidates = []
+    for i in outer_plans:
+        n_outer, n_top, n_bottom = sizes[i]
+        best = pairs[i][1][:beam_width]
+        candidates.append(torch.sort((torch.arange(n_outer)[:, None] * n_top * n_bottom + best).flatten()).values)
+    second = score_candidates([scorers[i] for i in outer_plans], candidates, width, chunk_size)
+
+    # 3. every bottom for the best (outer, top) pairs of step 2
+    third = [(torch.empty(0), torch.empty(0, dtype=torch.long)) for _ in outer_plans]
+    if symmetric:
+        candidates = []
+        for j, i in enumerate(outer_plans):
+            n_outer, n_top, n_bottom = sizes[i]
+            outer_tops = list(dict.fromkeys((second[j][1] // n_bottom).tolist()))[:beam_width]
+            flat = (torch.tensor(outer_tops, dtype=torch.long)[:, None] * n_bottom + torch.arange(n_bottom)).flatten()
+            flat = flat[~torch.isin(flat, second[j][1])]
+            candidates.append(torch.sort(flat).values)
+        third = score_candidates([scorers[i] for i in outer_plans], candidates, width, chunk_size)
+
+    results = [(scores[:k], flat[:k]) for scores, flat in pairs]
+    for j, i in enumerate(outer_plans):
+        results[i] = _top_k_of([second[j], third[j]], k)
+    return results
+
+
+# Latency and top-k overlap of the beam search against the exact search
+# Returns one row per (wardrobe size, beam width)
+def benchmark(model, vocab, wardrobes_by_size, weathers, beam_widths, top_k=5, symmetric=True,
+              chunk_size=CHUNK_SIZE):
+    from .inference import encode_wardrobe, plan_outfits, score_plans
+
+    rows = []
+    for merge, wardrobes in wardrobes_by_size.items():
+        plans = []
+        for wardrobe in wardrobes:
+            user_id = wardrobe["user_id"].iloc[0]
+            encoded = encode_wardrobe(vocab, wardrobe, user_id)
+            if encoded is not None:
+                plans += [plan_outfits(vocab, encoded, user_id, weather) for weather in weathers]
+        plans = [plan for plan in plans if plan is not None and plan["has_outer"]]
+        if not plans:
+            continue
+
+        def run(beam_width):
+            best, elapsed = [], 0.0
+            for plan in plans:
+                start = time.perf_counter()
+                if beam_width is None:
+                    [(_, flat)] = score_plans(model, vocab, [plan], top_k, chunk_size=chunk_size)
+                else:
+                    [(_, flat)] = beam_top_k_packed(model, ForwardScorer, [plan], vocab, top_k, beam_width,
+                                                    symmetric, chunk_size)
+                elapsed += time.perf_counter() - start
+                best.append(flat.tolist())
+            return best, 1000 * elapsed / len(plans)
+
+        exact, exact_ms = run(None)
+        items = np.mean([sum(len(codes) for codes, _ in plan["slots"].values()) for plan in plans])
+        for beam_width in beam_widths:
+            beam, beam_ms = run(beam_width)
+            rows.append({
+                "merge": merge,
+                "items": float(items),
+                "beam_width": beam_width,
+                "overlap": float(np.mean([len(set(e) & set(b)) / len(e) for e, b in zip(exact, beam)])),
+                "identical": float(np.mean([e == b for e, b in zip(exact, beam)])),
+                "exact_ms": exact_ms,
+                "beam_ms": beam_ms,
+            })
+    return rows
+
+
+def main():
+    from .inference import REFERENCE_WEATHERS, load_model
+
+    parser = argparse.ArgumentParser(description="Latency and overlap of beam-search outfit assembly vs exact search.")
+    parser.add_argument("model_path", help="Checkpoint (.pth) with its .vocab.json next to it")
+    parser.add_argument("--dataset", default=REPORT_DATASET, help="Training CSV the wardrobes are built from")
+    parser.add_argument("--merge", type=int, nargs="+", default=[1, 5, 10, 20, 40],
+                        help="Users merged into one wardrobe (growing wardrobe sizes)")
+    parser.add_argument("--beam-width", type=int, nargs="+", default=[4, 8, 16, 32], help="Beam widths to compare")
+    parser.add_argument("--top-k", type=int, default=5, help="Recommendations per request")
+    parser.add_argument("--one-sided", action="store_true", help="Skip the (outer, top) -> bottom step")
+    parser.add_argument("--max-wardrobes", type=int, default=5, help="Wardrobes benchmarked per size")
+    args = parser.parse_args()
+
+    model, vocab = load_model(args.model_path)
+    cold = [weather for weather in REFERENCE_WEATHERS if weather["temperature"] < 18]
+    wardrobes = {merge: report_wardrobes(args.dataset, vocab, merge)[:args.max_wardrobes] for merge in args.merge}
+    rows = benchmark(model, vocab, wardrobes, cold, args.beam_width, args.top_k, not args.one_sided)
+
+    print(f"{'items':>6} {'beam':>5} {'overlap@k':>10} {'identical':>10} {'exact ms':>9} {'beam ms':>8} {'speedup':>8}")
+    for row in rows:
+        print(f"{row['items']:>6.0f} {row['beam_width']:>5} {row['overlap']:>10.3f} {row['identical']:>10.2f} "
+              f"{row['exact_ms']:>9.2f} {row['beam_ms']:>8.2f} {row['exact_ms'] / row['beam_ms']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from .scoring import ITEM_FEATURES, outfit_shape
+
+# Size of the weather buckets used in cache keys (degrees C, % rain chance, m/s wind)
+WEATHER_BUCKETS = {"temperature": 0.5, "rain": 5.0, "wind": 1.0}
+# Maximum number of cached recommendation lists
+CACHE_SIZE = 1024
+# Seconds a cached recommendation list stays valid
+CACHE_TTL = 600
+
+
+# Stable hash of a wardrobe: same items with the same attributes -> same fingerprint,
+# regardless of the order the items were sent in
+def wardrobe_fingerprint(wardrobe_df):
+    columns = [c for c in ["item_id"] + ITEM_FEATURES + ["favorite"] if c in wardrobe_df.columns]
+    items = wardrobe_df[columns]
+    if "item_id" in columns:
+        items = items.sort_values("item_id")
+    rows = items.to_csv(index=False)
+    return hashlib.sha1(rows.encode("utf-8")).hexdigest()
+
+
+# Round the weather to buckets, so almost identical weather shares cache entries
+# The outfit shape flags (see scoring.outfit_shape) are part of the key, so a bucket never
+# mixes temperatures on both sides of a threshold (e.g. 17.9 and 18.1 degrees C)
+def quantize_weather(weather, buckets=WEATHER_BUCKETS):
+    rounded = tuple(round(weather[name] / size) for name, size in buckets.items())
+    return rounded + outfit_shape(weather["temperature"])
+
+
+    # LRU + TTL cache of recommendation lists.
+    # - Key: user id, wardrobe fingerprint, quantized weather and top_k
+    # - Least recently used entries are evicted above max_size, expired ones on access
+    # - invalidate_user() drops every entry of a user (wardrobe changed)
+    # - Thread safe, since /recommend runs on FastAPI's threadpool
+
+class RecommendationCache:
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL, buckets=WEATHER_BUCKETS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.buckets = buckets
+        self.entries = OrderedDict()  # key -> (expiry time, recommendations)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, user_id, wardrobe_df, weather, top_k):
+        return user_id, wardrobe_fingerprint(wardrobe_df), quantize_weather(weather, self.buckets), top_k
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, recs):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, recs)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    # Return the cached recommendations, or compute and store them
+    def get_or_compute(self, user_id, wardrobe_df, weather, top_k, compute):
+        key = self.key(user_id, wardrobe_df, weather, top_k)
+        recs = self.get(key)
+        if recs is None:
+            recs = compute()
+            self.put(key, recs)
+        return recs
+
+    # Drop all entries of a user, e.g. after an item was added or deleted
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == user_id]:
+                del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+    # Per-user cache of encoded wardrobes (category codes + favorites per slot).
+    # - Filled (e.g. from the stored item codes) on the first recommendation of a user
+    # - invalidate_user() must be called whenever the user's items are written
+    # - Least recently used users are evicted above max_users; max_users=0 keeps nothing
+    #   (e.g. several server processes, where a write only reaches the cache of one of them)
+
+class EncodedWardrobeCache:
+    def __init__(self, max_users=CACHE_SIZE):
+        self.max_users = max_users
+        self.entries = OrderedDict()  # user_id -> encoded wardrobe (or None if no outfit is possible)
+        self.versions = {}  # user_id -> number of invalidations, to drop encodings that raced a write
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Encoded wardrobe of a user; load() builds it on a miss
+    def get(self, user_id, load):
+        with self.lock:
+            if user_id in self.entries:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return self.entries[user_id]
+            self.misses += 1
+            version = self.versions.get(user_id, 0)
+
+        encoded = load()
+        with self.lock:
+            # an item written while encoding makes this encoding stale: do not keep it
+            if self.versions.get(user_id, 0) == version and self.max_users > 0:
+                self.entries[user_id] = encoded
+                while len(self.entries) > self.max_users:
+                    self.entries.popitem(last=False)
+        return encoded
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+            self.versions[user_id] = self.versions.get(user_id, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {"users": len(self.entries), "hits": self.hits, "misses": self.misses}
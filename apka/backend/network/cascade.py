@@ -0,0 +1,242 @@
+# Two-stage candidate cascade for very large wardrobes.
+# Stage 1 ranks every outfit combination with the cheap weather rules and colour
+# compatibility of OutfitPairRecommender (data/scored_data/out/Recommendation.py),
+# vectorized over item codes; only the top_m combinations reach stage 2, the
+# RecommenderNet scoring. Offline recall against exhaustive neural ranking:
+#   python -m network.cascade network/final_version.pth --top-m 25 50 100 200
+
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import torch
+from .scoring import CHUNK_SIZE, ITEM_FEATURES, combo_index, n_combos, stream_top_k, stream_top_k_packed
+
+# Combinations kept by the rule-based pre-ranking when the cascade is enabled
+CASCADE_SIZE = 200
+
+# Colour pairs that go well together (besides equal colours), as in OutfitPairRecommender.color_compat
+COLOR_PAIRS = [("Black", "White"), ("Blue", "Gray")]
+
+# Training CSV the recall report builds its wardrobes from
+REPORT_DATASET = os.path.join(os.path.dirname(__file__), "data", "scored_data", "out", "training_base.csv")
+
+
+# Category values (strings) of one attribute for every item of a slot
+def decode_attribute(codes, slot, attr, vocab):
+    classes = vocab.encoders[f"{slot}_{attr}"].classes_
+    return classes[codes[:, ITEM_FEATURES.index(attr)].numpy()]
+
+
+# OutfitPairRecommender.rule_score of every item of a slot, computed on whole columns
+def item_rule_scores(codes, favorites, slot, vocab, weather):
+    values = {attr: decode_attribute(codes, slot, attr, vocab) for attr in ("type", "material", "special_property")}
+    item_type, material, special = values["type"], values["material"], values["special_property"]
+    temp, rain, wind = weather["temperature"], weather["rain"], weather["wind"]
+    score = np.zeros(len(codes))
+
+    # Temperature rules
+    if temp < 5:
+        score += 2 + np.isin(material, ["Wool", "Fleece"]) + 1.5 * (special == "Insulated")
+    elif temp < 15:
+        score += 1
+    elif temp > 25:
+        score += np.isin(material, ["Cotton", "Linen", "Polyester"]) + np.isin(special, ["Breathable", "Quick-drying"])
+
+    # Rain rules
+    if rain > 70:
+        score += np.where(special == "Waterproof", 2, np.isin(material, ["Polyester", "Leather"]).astype(float))
+    elif rain > 30:
+        score += np.isin(special, ["Quick-drying", "Waterproof"])
+
+    # Wind rules
+    if wind > 25:
+        score += np.isin(item_type, ["Jacket", "Sweatshirt", "Coat"]) + 1.5 * (special == "Windproof")
+
+    # Universal comfort / favorite
+    score += 0.5 * (special == "Non-restrictive") + 0.5 * (favorites.numpy() == 1)
+
+    # Extra bonus for wool outerwear if cold
+    if temp < 10:
+        score += 2 * (np.isin(item_type, ["Jacket", "Coat"]) & (material == "Wool"))
+
+    return torch.tensor(score, dtype=torch.float32)
+
+
+# OutfitPairRecommender.color_compat of every pair of colours in c1 x c2
+def color_compat(c1, c2):
+    c1, c2 = c1[:, None], c2[None, :]
+    pair = np.zeros((len(c1), c2.shape[1]), dtype=bool)
+    for a, b in COLOR_PAIRS:
+        pair |= ((c1 == a) & (c2 == b)) | ((c1 == b) & (c2 == a))
+    return torch.tensor(np.where(c1 == c2, 1.0, np.where(pair, 0.75, 0.3)), dtype=torch.float32)
+
+
+# Scores chunks of combinations with the rules only (no model)
+# rule(outer) + rule(top) + rule(bottom) + colour compatibility, like
+# OutfitPairRecommender with rule_weight=1
+class RuleScorer:
+    def __init__(self, slots, weather, vocab, has_outer):
+        self.slots = slots
+        self.has_outer = has_outer
+        self.items = {slot: item_rule_scores(codes, favs, slot, vocab, weather) for slot, (codes, favs) in slots.items()}
+        colors = {slot: decode_attribute(codes, slot, "color", vocab) for slot, (codes, _) in slots.items()}
+        self.top_bottom = color_compat(colors["top"], colors["bottom"])
+        if has_outer:
+            self.outer_top = color_compat(colors["outer"], colors["top"])
+        else:
+            self.items["outer"] = torch.zeros(1)
+
+    def features(self, flat):
+        index = combo_index(self.slots, flat)
+        return index["outer"], index["top"], index["bottom"]
+
+    def head(self, o, t, b):
+        score = self.items["outer"][o] + self.items["top"][t] + self.items["bottom"][b]
+        if self.has_outer:
+            return score + (self.outer_top[o, t] + self.top_bottom[t, b]) / 2
+        return score + self.top_bottom[t, b]
+
+    def __call__(self, flat):
+        return self.head(*self.features(flat))
+
+
+# Flat indices (ascending) of the top_m combinations of a plan by rule score
+# Plans with at most top_m combinations are not pruned
+def prune_candidates(plan, vocab, top_m, chunk_size=CHUNK_SIZE):
+    total = n_combos(plan["slots"])
+    if total <= top_m:
+        return torch.arange(total)
+    rules = RuleScorer(plan["slots"], plan["weather"], vocab, plan["has_outer"])
+    _, flat = stream_top_k(rules, total, top_m, chunk_size)
+    # enumeration order, so ties in the neural scores rank like the exhaustive search
+    return torch.sort(flat).values
+
+
+# Scorer restricted to a subset of combinations: index i scores candidates[i]
+class CandidateScorer:
+    def __init__(self, scorer, candidates):
+        self.scorer = scorer
+        self.candidates = candidates
+
+    def features(self, idx):
+        return self.scorer.features(self.candidates[idx])
+
+    def head(self, *inputs):
+        return self.scorer.head(*inputs)
+
+    def __call__(self, idx):
+        return self.head(*self.features(idx))
+
+
+# Score given combinations (ascending flat indices) of several scorers in shared batches
+# Returns a list of (scores, flat indices) of the k best candidates, highest first
+def score_candidates(scorers, candidates, k, chunk_size=CHUNK_SIZE):
+    restricted = [CandidateScorer(scorer, c) for scorer, c in zip(scorers, candidates)]
+    best = stream_top_k_packed(restricted, [len(c) for c in candidates], k, chunk_size)
+    return [(scores, c[idx]) for (scores, idx), c in zip(best, candidates)]
+
+
+# Cascade version of stream_top_k_packed: the neural scorers only see the top_m
+# rule-ranked combinations of their plan
+# Returns a list of (scores, flat indices) of the k best combinations, highest first
+def cascade_top_k_packed(scorers, plans, vocab, k, top_m=CASCADE_SIZE, chunk_size=CHUNK_SIZE):
+    candidates = [prune_candidates(plan, vocab, top_m, chunk_size) for plan in plans]
+    return score_candidates(scorers, candidates, k, chunk_size)
+
+
+# Wardrobes (one DataFrame per user) rebuilt from the flattened outfit rows of a training CSV
+# Items with categories the vocabulary does not know are left out
+# merge > 1 combines the wardrobes of several users into one, to emulate very large wardrobes
+def report_wardrobes(dataset_path, vocab, merge=1):
+    df = pd.read_csv(dataset_path)
+    items = []
+    for slot in ("top", "bottom", "outer"):
+        columns = {f"{slot}_{c}": c for c in ITEM_FEATURES + ["favorite"]}
+        part = df[["user_id", f"{slot}_id"] + list(columns)].rename(columns={f"{slot}_id": "source_id", **columns})
+        known = np.all([part[c].isin(vocab.categories[f"{slot}_{c}"]) for c in ITEM_FEATURES], axis=0)
+        part = part[known & (part["type"] != "missing")]
+        items.append(part.drop_duplicates(["user_id", "source_id"]).assign(slot=slot))
+    items = pd.concat(items, ignore_index=True)
+
+    users = sorted(items["user_id"].unique())
+    wardrobes = []
+    for start in range(0, len(users), merge):
+        group = users[start:start + merge]
+        wardrobe = items[items["user_id"].isin(group)].reset_index(drop=True)
+        wardrobe["item_id"] = np.arange(1, len(wardrobe) + 1)
+        wardrobe["user_id"] = group[0]
+        wardrobes.append(wardrobe)
+    return wardrobes
+
+
+# Recall@top_k of the cascade against exhaustive neural ranking, and the time both take
+# Returns one row per top_m
+def recall_report(model, vocab, wardrobes, weathers, top_ms, top_k=5, chunk_size=CHUNK_SIZE):
+    from .inference import encode_wardrobe, plan_outfits, score_plans
+
+    plans = []
+    for wardrobe in wardrobes:
+        user_id = wardrobe["user_id"].iloc[0]
+        encoded = encode_wardrobe(vocab, wardrobe, user_id)
+        if encoded is not None:
+            plans += [plan_outfits(vocab, encoded, user_id, weather) for weather in weathers]
+    plans = [plan for plan in plans if plan is not None]
+
+    def run(top_m):
+        best, elapsed = [], 0.0
+        for plan in plans:
+            start = time.perf_counter()
+            [(_, flat)] = score_plans(model, vocab, [plan], top_k, chunk_size=chunk_size, top_m=top_m)
+            elapsed += time.perf_counter() - start
+            best.append(flat.tolist())
+        return best, elapsed
+
+    exhaustive, exhaustive_time = run(None)
+    rows = []
+    for top_m in top_ms:
+        cascade, cascade_time = run(top_m)
+        recall = [len(set(e) & set(c)) / len(e) for e, c in zip(exhaustive, cascade) if e]
+        rows.append({
+            "top_m": top_m,
+            "recall": float(np.mean(recall)),
+            "min_recall": float(np.min(recall)),
+            "identical": float(np.mean([e == c for e, c in zip(exhaustive, cascade)])),
+            "ms_per_request": 1000 * cascade_time / len(plans),
+            "speedup": exhaustive_time / cascade_time,
+        })
+    return {
+        "requests": len(plans),
+        "mean_combinations": float(np.mean([n_combos(plan["slots"]) for plan in plans])),
+        "exhaustive_ms_per_request": 1000 * exhaustive_time / len(plans),
+        "rows": rows,
+    }
+
+
+def main():
+    from .inference import REFERENCE_WEATHERS, load_model
+
+    parser = argparse.ArgumentParser(description="Recall of the rule-based cascade against exhaustive neural ranking.")
+    parser.add_argument("model_path", help="Checkpoint (.pth) with its .vocab.json next to it")
+    parser.add_argument("--dataset", default=REPORT_DATASET, help="Training CSV the wardrobes are built from")
+    parser.add_argument("--top-m", type=int, nargs="+", default=[25, 50, 100, 200, 400],
+                        help="Combinations kept by the pre-ranking")
+    parser.add_argument("--top-k", type=int, default=5, help="Recommendations per request")
+    parser.add_argument("--merge", type=int, default=1, help="Users merged into one wardrobe (larger wardrobes)")
+    args = parser.parse_args()
+
+    model, vocab = load_model(args.model_path)
+    report = recall_report(model, vocab, report_wardrobes(args.dataset, vocab, args.merge), REFERENCE_WEATHERS,
+                           args.top_m, args.top_k)
+
+    print(f"{report['requests']} requests, {report['mean_combinations']:.0f} combinations on average, "
+          f"exhaustive: {report['exhaustive_ms_per_request']:.2f} ms/request")
+    print(f"{'top_m':>6} {'recall@k':>9} {'min':>6} {'identical':>10} {'ms/req':>8} {'speedup':>8}")
+    for row in report["rows"]:
+        print(f"{row['top_m']:>6} {row['recall']:>9.3f} {row['min_recall']:>6.2f} {row['identical']:>10.2f} "
+              f"{row['ms_per_request']:>8.2f} {row['speedup']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Export step for CPU serving: produces a frozen TorchScript model and a
+# dynamically int8-quantized one next to the checkpoint.
+#   python -m network.export network/final_version.pth
+# load_model(..., variant="torchscript" | "quantized") serves them.
+
+import argparse
+import os
+import torch
+import torch.nn as nn
+
+# File suffix of every exported variant, e.g. final_version.pth -> final_version.int8.pt
+VARIANT_SUFFIXES = {
+    "torchscript": ".ts.pt",
+    "quantized": ".int8.pt",
+}
+
+
+# Path of an exported variant that belongs to a model checkpoint
+def variant_path(model_path, variant):
+    if variant not in VARIANT_SUFFIXES:
+        raise ValueError(f"Unknown model variant '{variant}', expected one of {list(VARIANT_SUFFIXES)}")
+    return os.path.splitext(model_path)[0] + VARIANT_SUFFIXES[variant]
+
+
+# Example inputs used for tracing (batch of 2 so no dimension is specialised to 1)
+def example_inputs(vocab):
+    cat = torch.zeros((2, len(vocab.cat_features)), dtype=torch.long)
+    num = torch.zeros((2, len(vocab.numeric_features)), dtype=torch.float32)
+    return cat, num
+
+
+# Trace and freeze a model into a TorchScript module
+def freeze(model, vocab):
+    model.eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example_inputs(vocab))
+    return torch.jit.freeze(traced)
+
+
+# Build the requested variant of an eager RecommenderNet
+def build_variant(model, vocab, variant):
+    if variant == "torchscript":
+        return freeze(model, vocab)
+    if variant == "quantized":
+        # int8 weights for the hidden Linear layers, activations quantized on the fly
+        # The first layer stays float32: it sees raw weather values (-5..100) next to
+        # 0/1 flags, and a single int8 activation scale loses the small ones
+        hidden = {f"model.{i}" for i, layer in enumerate(model.model) if isinstance(layer, nn.Linear) and i > 0}
+        quantized = torch.ao.quantization.quantize_dynamic(model, hidden, dtype=torch.qint8)
+        return freeze(quantized, vocab)
+    raise ValueError(f"Unknown model variant '{variant}', expected one of {list(VARIANT_SUFFIXES)}")
+
+
+# Export every variant of the model next to its checkpoint
+def export_variants(model, vocab, model_path):
+    paths = {}
+    for variant in VARIANT_SUFFIXES:
+        paths[variant] = variant_path(model_path, variant)
+        torch.jit.save(build_variant(model, vocab, variant), paths[variant])
+    return paths
+
+
+def main():
+    from .inference import load_model, check_variant
+
+    parser = argparse.ArgumentParser(description="Export TorchScript and int8-quantized variants of a checkpoint.")
+    parser.add_argument("model_path", help="Checkpoint (.pth) with its .vocab.json next to it")
+    parser.add_argument("--dataset", default=None, help="Training CSV, only needed if the vocabulary is missing")
+    args = parser.parse_args()
+
+    model, vocab = load_model(args.model_path, args.dataset)
+    for variant, path in export_variants(model, vocab, args.model_path).items():
+        report = check_variant(model, torch.jit.load(path), vocab)
+        size = os.path.getsize(path) / 1024
+        print(f"{variant}: saved {path} ({size:.1f} KiB), max score diff {report['max_abs_diff']:.4f}, "
+              f"top-k rankings identical: {report['rankings_identical']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,105 +1,243 @@
+import os
 import torch
 import pandas as pd
-import itertools
-from .train.model import RecommenderNet
+from .train.model import RecommenderNet, StudentNet, student_path
 from .train.dataset import FashionDataset
+from .train.vocabulary import Vocabulary, vocabulary_path
+from .scoring import (CHUNK_SIZE, ITEM_FEATURES, FactorizedScorer, ForwardScorer, combo_index, encode_items,
+                      encode_slot, n_combos, outfit_shape, select_top_k, stream_top_k_packed)
+from .export import build_variant, variant_path
+from .cascade import cascade_top_k_packed
+from .beam import beam_top_k_packed
 
-def load_model(model_path, dataset_path):
-    # Load dataset only to extract encoders and numeric feature dimensions
-    temp_dataset = FashionDataset(dataset_path)  # To get encoders & dims
-    # Category sizes for embeddings
-    cat_dims = [len(enc.classes_) for enc in temp_dataset.encoders.values()]
-    # Embedding dimensions
-    emb_dims = [min(50, (dim + 1) // 2) for dim in cat_dims]
-    num_input_dim = temp_dataset.numeric.shape[1]
-
-    model = RecommenderNet(cat_dims, emb_dims, num_input_dim)
-    # Load trained weights
-    checkpoint = torch.load(model_path, map_location="cpu")
-    model.load_state_dict(checkpoint["model_state_dict"], strict=False)
-    model.eval()
-    return model, temp_dataset
-    
-# Convert one outfit combination (top/bottom/outer + weather)
-# into properly encoded categorical + numerical tensors
-def prepare_features(row_top, row_bottom, row_outer, weather, dataset):
-
-    record = {
-        **{f"top_{c}": row_top[c] for c in ["type", "color", "material", "size", "style", "special_property"]},
-        **{f"bottom_{c}": row_bottom[c] for c in ["type", "color", "material", "size", "style", "special_property"]},
-    }
+# Item types (lower case) that make up each slot of an outfit
+SLOT_TYPES = {
+    "top": ["sweater", "shirt", "t-shirt", "sweatshirt", "blazer"],
+    "bottom": ["skirt", "trousers", "shorts"],
+    "outer": ["coat", "jacket"],
+}
+
+# Reference wardrobe and weathers used to check exported model variants against the eager model
+REFERENCE_WARDROBE = os.path.join(os.path.dirname(__file__), "data", "scored_data", "out", "test.csv")
+REFERENCE_WEATHERS = [
+    {"temperature": 25.0, "rain": 0.0, "wind": 5.0},
+    {"temperature": 16.0, "rain": 30.0, "wind": 10.0},
+    {"temperature": 10.0, "rain": 70.0, "wind": 20.0},
+    {"temperature": -2.0, "rain": 90.0, "wind": 30.0},
+]
+# Largest score difference to the eager model accepted for each variant
+VARIANT_TOLERANCES = {"torchscript": 1e-4, "quantized": 0.15}
 
-    if row_outer is not None:
-        record.update({
-            **{f"outer_{c}": row_outer[c] for c in ["type", "color", "material", "size", "style", "special_property"]}
-        })
+
+# Load the trained model together with its vocabulary artifact
+# The vocabulary is read from "<checkpoint>.vocab.json"; if it does not exist yet,
+# it is built once from the training CSV (dataset_path) and saved next to the checkpoint
+# variant selects the served model: "eager", "torchscript" or "quantized" (see network/export.py);
+# exported variants are checked against the eager model unless check=False
+# student=True serves the distilled StudentNet of the checkpoint (see network/train/distill.py)
+def load_model(model_path, dataset_path=None, variant="eager", check=True, student=False):
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model checkpoint {model_path} not found")
+    vocab_file = vocabulary_path(model_path)
+    if os.path.exists(vocab_file):
+        vocab = Vocabulary.load(vocab_file)
+    elif dataset_path is not None:
+        print(f"Vocabulary {vocab_file} not found, building it from {dataset_path}")
+        vocab = Vocabulary.from_dataset(FashionDataset(dataset_path))
+        vocab.save(vocab_file)
     else:
-        for col in ["outer_type", "outer_color", "outer_material", "outer_size", "outer_style", "outer_special_property"]:
-            record[col] = "missing"
+        raise FileNotFoundError(f"Vocabulary {vocab_file} not found and no training dataset given")
 
-    has_outer = 1 if row_outer is not None else 0
-    outer_fav = row_outer["favorite"] if row_outer is not None else 0.0
+    if student:
+        model_path = student_path(model_path)
+        checkpoint = torch.load(model_path, map_location="cpu")
+        model = StudentNet(vocab.categories, len(vocab.numeric_features), **checkpoint["config"])
+        model.load_state_dict(checkpoint["model_state_dict"])
+    else:
+        model = RecommenderNet(vocab.cat_dims, vocab.emb_dims, len(vocab.numeric_features))
+        # Load trained weights
+        checkpoint = torch.load(model_path, map_location="cpu")
+        model.load_state_dict(checkpoint["model_state_dict"], strict=False)
+    model.eval()
+    if variant == "eager":
+        return model, vocab
 
-    num_data = torch.tensor([[weather["temperature"], weather["rain"], weather["wind"],
-                              row_top["favorite"], row_bottom["favorite"], outer_fav, has_outer]], dtype=torch.float32)
+    # Use the exported file if there is one, otherwise build the variant in memory
+    path = variant_path(model_path, variant)
+    served = torch.jit.load(path, map_location="cpu") if os.path.exists(path) else build_variant(model, vocab, variant)
+    if check:
+        report = check_variant(model, served, vocab)
+        print(f"Model variant '{variant}': max score diff {report['max_abs_diff']:.5f}, "
+              f"top-k rankings identical: {report['rankings_identical']}")
+        if report["max_abs_diff"] > VARIANT_TOLERANCES[variant] or report["top_k_overlap"] < 1.0:
+            raise RuntimeError(f"Model variant '{variant}' does not match the eager model: {report}")
+    return served, vocab
 
-    cat_vals = []
-    for col in dataset.cat_features:
-        le = dataset.encoders[col]
-        val = record.get(col, "missing")
-        if val not in le.classes_:
-            val = "missing"
-        cat_vals.append(le.transform([val])[0])
 
-    cat = torch.tensor([cat_vals], dtype=torch.long)
-    return cat, num_data
+# Compare a model variant with the eager model on the reference wardrobe
+# Every combination is scored under each reference weather; returns the largest score
+# difference and whether the top-k outfits (set and order) are the same
+def check_variant(reference, candidate, vocab, top_k=5, wardrobe_path=REFERENCE_WARDROBE):
+    wardrobe_df = pd.read_csv(wardrobe_path)
+    user_id = wardrobe_df["user_id"].iloc[0]
+    encoded = encode_wardrobe(vocab, wardrobe_df, user_id)
 
-# Generate outfit recommendations for a given user
-def recommend_outfits(model, dataset, wardrobe_df, user_id, weather, top_k=5):
+    max_diff, identical, overlap = 0.0, True, []
+    with torch.no_grad():
+        for weather in REFERENCE_WEATHERS:
+            plan = plan_outfits(vocab, encoded, user_id, weather)
+            flat = torch.arange(n_combos(plan["slots"]))
+            expected = ForwardScorer(reference, plan["slots"], weather, vocab, plan["has_outer"])(flat)
+            actual = ForwardScorer(candidate, plan["slots"], weather, vocab, plan["has_outer"])(flat)
+            max_diff = max(max_diff, (expected - actual).abs().max().item())
+
+            best_expected = select_top_k(expected, top_k).tolist()
+            best_actual = select_top_k(actual, top_k).tolist()
+            identical = identical and best_expected == best_actual
+            overlap.append(len(set(best_expected) & set(best_actual)) / len(best_expected))
+
+    return {"max_abs_diff": max_diff, "rankings_identical": identical, "top_k_overlap": min(overlap)}
+
+# Split a user's wardrobe into tops / bottoms / outers and encode every item once
+# Returns {slot: {"codes", "favorites", "ids", "types"}} or None if no outfit can be built
+def encode_wardrobe(vocab, wardrobe_df, user_id):
 
     wardrobe = wardrobe_df[wardrobe_df["user_id"] == user_id]
 
     if wardrobe.empty:
         print(f"No wardrobe items found for user {user_id}.")
-        return []
+        return None
 
-    tops = wardrobe[wardrobe["type"].str.lower().isin(["sweater", "shirt", "t-shirt", "sweatshirt", "blazer"])]
-    bottoms = wardrobe[wardrobe["type"].str.lower().isin(["skirt", "trousers", "shorts"])]
-    outers = wardrobe[wardrobe["type"].str.lower().isin(["coat", "jacket"])]
+    tops = wardrobe[wardrobe["type"].str.lower().isin(SLOT_TYPES["top"])]
+    bottoms = wardrobe[wardrobe["type"].str.lower().isin(SLOT_TYPES["bottom"])]
+    outers = wardrobe[wardrobe["type"].str.lower().isin(SLOT_TYPES["outer"])]
 
     if tops.empty or bottoms.empty:
         print(f"No suitable tops or bottoms found for user {user_id}.")
-        return []
+        return None
+
+    encoded = {}
+    for slot, items in (("top", tops), ("bottom", bottoms), ("outer", outers)):
+        codes, favorites = encode_slot(items, slot, vocab)
+        encoded[slot] = {"codes": codes, "favorites": favorites,
+                         "ids": items["item_id"].tolist(), "types": items["type"].tolist()}
+    return encoded
+
+
+# Category codes of wardrobe items for the columns of the slot each item belongs to
+# Returns {item_id: (slot, [codes in ITEM_FEATURES order])}; items that fit no slot are skipped
+def encode_item_codes(vocab, items_df):
+    result = {}
+    types = items_df["type"].str.lower()
+    for slot, slot_types in SLOT_TYPES.items():
+        items = items_df[types.isin(slot_types)]
+        if items.empty:
+            continue
+        codes = encode_items(items, slot, vocab)
+        for item_id, item_codes in zip(items["item_id"].tolist(), codes.tolist()):
+            result[item_id] = (slot, item_codes)
+    return result
+
 
-    outfit_candidates = []
+# Build an encoded wardrobe (as returned by encode_wardrobe) from stored category codes
+# rows: list of {"item_id", "type", "favorite", "slot", "codes"}
+def encoded_from_codes(rows, user_id):
+    encoded = {}
+    for slot in ("top", "bottom", "outer"):
+        slot_rows = [row for row in rows if row["slot"] == slot]
+        encoded[slot] = {
+            "codes": torch.tensor([row["codes"] for row in slot_rows], dtype=torch.long).reshape(-1, len(ITEM_FEATURES)),
+            "favorites": torch.tensor([float(row["favorite"]) for row in slot_rows], dtype=torch.float32),
+            "ids": [row["item_id"] for row in slot_rows],
+            "types": [row["type"] for row in slot_rows],
+        }
 
-    temp = weather["temperature"]
+    if not encoded["top"]["ids"] or not encoded["bottom"]["ids"]:
+        print(f"No suitable tops or bottoms found for user {user_id}.")
+        return None
+    return encoded
+
+
+# Pick the outfit combinations allowed by the weather from an encoded wardrobe
+# Returns a plan {"slots", "ids", "has_outer", "weather", "user_id"} or None
+# shape (see scoring.outfit_shape) overrides the outfit shape of the weather's temperature,
+# e.g. to score a weather bucket at its centre but keep the shape of the bucket
+def plan_outfits(vocab, encoded, user_id, weather, shape=None):
+    no_skirts, wants_outer = shape if shape is not None else outfit_shape(weather["temperature"])
+    top, bottom, outer = encoded["top"], encoded["bottom"], encoded["outer"]
 
-    if temp < 15:
-        bottoms = bottoms[~bottoms['type'].isin(['Skirt', 'Shorts'])]
+    keep = list(range(len(bottom["ids"])))
+    if no_skirts:
+        keep = [i for i in keep if bottom["types"][i] not in ['Skirt', 'Shorts']]
+
+    slots = {
+        "top": (top["codes"], top["favorites"]),
+        "bottom": (bottom["codes"][keep], bottom["favorites"][keep]),
+    }
+    ids = {"top": top["ids"], "bottom": [bottom["ids"][i] for i in keep]}
 
-    if temp < 18 and not outers.empty:
-        combos = itertools.product(outers.iterrows(), tops.iterrows(), bottoms.iterrows())
-        for (_, outer), (_, top), (_, bottom) in combos:
-            cat, num = prepare_features(top, bottom, outer, weather, dataset)
-            with torch.no_grad():
-                score = model(cat, num).item()
-            outfit_candidates.append((outer["item_id"], top["item_id"], bottom["item_id"], score))
+    has_outer = wants_outer and len(outer["ids"]) > 0
+    if has_outer:
+        slots["outer"] = (outer["codes"], outer["favorites"])
+        ids["outer"] = outer["ids"]
     else:
-        if temp < 18 and outers.empty:
+        if wants_outer:
             print(f"Temperature < 18°C but no outerwear available for user {user_id}. Recommending top-bottom only.")
-        combos = itertools.product(tops.iterrows(), bottoms.iterrows())
-        for (_, top), (_, bottom) in combos:
-            cat, num = prepare_features(top, bottom, None, weather, dataset)
-            with torch.no_grad():
-                score = model(cat, num).item()
-            outfit_candidates.append((None, top["item_id"], bottom["item_id"], score))
-
-    if not outfit_candidates:
+        slots["outer"] = encode_slot(None, "outer", vocab)
+        ids["outer"] = [None]
+
+    if n_combos(slots) == 0:
         print(f"No outfit combinations could be generated for user {user_id}.")
+        return None
+    return {"slots": slots, "ids": ids, "has_outer": has_outer, "weather": weather, "user_id": user_id}
+
+
+# Score the combinations of several plans in shared model batches
+# top_m enables the rule-based cascade (see network/cascade.py): only the top_m
+# combinations of each plan by rule score are scored by the model
+# beam_width enables the beam search over outfit pieces instead (see network/beam.py)
+# Returns (scores, flat indices) of the top_k combinations of every plan
+def score_plans(model, vocab, plans, top_k, factorized=False, chunk_size=CHUNK_SIZE, top_m=None, beam_width=None):
+    scorer_cls = FactorizedScorer if factorized else ForwardScorer
+    if beam_width is not None:
+        return beam_top_k_packed(model, scorer_cls, plans, vocab, top_k, beam_width, chunk_size=chunk_size)
+    scorers = [scorer_cls(model, plan["slots"], plan["weather"], vocab, plan["has_outer"]) for plan in plans]
+    if top_m is not None:
+        return cascade_top_k_packed(scorers, plans, vocab, top_k, top_m, chunk_size)
+    totals = [n_combos(plan["slots"]) for plan in plans]
+    return stream_top_k_packed(scorers, totals, top_k, chunk_size)
+
+
+# Turn the best combinations of a plan into (outer_id, top_id, bottom_id, score) tuples
+def plan_recommendations(plan, scores, best):
+    index = combo_index(plan["slots"], best)
+    ids = plan["ids"]
+    return [
+        (ids["outer"][o], ids["top"][t], ids["bottom"][b], score)
+        for o, t, b, score in zip(index["outer"].tolist(), index["top"].tolist(),
+                                  index["bottom"].tolist(), scores.tolist())
+    ]
+
+
+# Generate outfit recommendations for a given user
+# factorized=True scores combinations from cached per-item first-layer activations
+# chunk_size bounds how many combinations are scored (and held in memory) at once
+# top_m (e.g. cascade.CASCADE_SIZE) lets only the top_m combinations by rule score reach the model
+# beam_width (e.g. beam.BEAM_WIDTH) assembles three-piece outfits by beam search instead of the full product
+# model may also be an InferenceScheduler shared by concurrent requests (forward-pass mode only)
+def recommend_outfits(model, vocab, wardrobe_df, user_id, weather, top_k=5, factorized=False,
+                      chunk_size=CHUNK_SIZE, top_m=None, beam_width=None):
+
+    encoded = encode_wardrobe(vocab, wardrobe_df, user_id)
+    if encoded is None:
+        return []
+    plan = plan_outfits(vocab, encoded, user_id, weather)
+    if plan is None:
         return []
 
-    recs = sorted(outfit_candidates, key=lambda x: x[-1], reverse=True)[:top_k]
+    # Score combinations in batched chunks, keeping only the running top-k in memory
+    [(scores, best)] = score_plans(model, vocab, [plan], top_k, factorized, chunk_size, top_m, beam_width)
+    recs = plan_recommendations(plan, scores, best)
 
     print(f"\nTop outfit recommendations for user {user_id}:")
     for outer_id, top_id, bottom_id, score in recs:
@@ -111,9 +249,55 @@ def recommend_outfits(model, dataset, wardrobe_df, user_id, weather, top_k=5):
     return recs
 
 
+# Generate outfit recommendations from an already encoded wardrobe (see encode_wardrobe)
+def recommend_encoded(model, vocab, encoded, user_id, weather, top_k=5, factorized=False, chunk_size=CHUNK_SIZE,
+                      top_m=None, beam_width=None):
+    if encoded is None:
+        return []
+    plan = plan_outfits(vocab, encoded, user_id, weather)
+    return recommend_plans(model, vocab, [plan], top_k, factorized, chunk_size, top_m, beam_width)[0]
+
+
+# Generate outfit recommendations for many users at once
+# requests: list of {"user_id", "wardrobe" (DataFrame), "weather"}
+# The candidate combinations of all users are packed into shared model batches
+# Returns one recommendation list per request, in request order
+def recommend_outfits_batch(model, vocab, requests, top_k=5, factorized=False, chunk_size=CHUNK_SIZE, top_m=None,
+                            beam_width=None):
+    plans = []
+    for req in requests:
+        encoded = encode_wardrobe(vocab, req["wardrobe"], req["user_id"])
+        plans.append(None if encoded is None else plan_outfits(vocab, encoded, req["user_id"], req["weather"]))
+
+    return recommend_plans(model, vocab, plans, top_k, factorized, chunk_size, top_m, beam_width)
+
+
+# Generate outfit recommendations for every day of a weather forecast
+# forecast: list of weather dictionaries, one per day
+# The wardrobe is encoded once; only the weather features change from day to day,
+# and all days are scored in shared model batches
+# Returns one recommendation list per day, in forecast order
+def recommend_outfits_forecast(model, vocab, wardrobe_df, user_id, forecast, top_k=5, factorized=False,
+                               chunk_size=CHUNK_SIZE, top_m=None, beam_width=None):
+    encoded = encode_wardrobe(vocab, wardrobe_df, user_id)
+    if encoded is None:
+        return [[] for _ in forecast]
+    plans = [plan_outfits(vocab, encoded, user_id, weather) for weather in forecast]
+    return recommend_plans(model, vocab, plans, top_k, factorized, chunk_size, top_m, beam_width)
+
+
+# Score several plans together and turn them into recommendation lists
+# Plans that are None (no outfit possible) get an empty list
+def recommend_plans(model, vocab, plans, top_k, factorized=False, chunk_size=CHUNK_SIZE, top_m=None,
+                    beam_width=None):
+    ready = [plan for plan in plans if plan is not None]
+    results = iter(score_plans(model, vocab, ready, top_k, factorized, chunk_size, top_m, beam_width))
+    return [[] if plan is None else plan_recommendations(plan, *next(results)) for plan in plans]
+
+
 if __name__ == "__main__":
 
-    model, dataset = load_model("final_version.pth", "data/scored_data/out/training_topOuter_clean.csv")
+    model, vocab = load_model("final_version.pth")
     wardrobe_df = pd.read_csv("data/scored_data/out/test.csv")
 
     user_id = 99
@@ -121,7 +305,7 @@ if __name__ == "__main__":
 
     recommend_outfits(
         model=model,
-        dataset=dataset,
+        vocab=vocab,
         wardrobe_df=wardrobe_df,
         user_id=user_id,
         weather=weather,
@@ -0,0 +1,183 @@
+import threading
+from collections import OrderedDict
+import pandas as pd
+from .cache import WEATHER_BUCKETS, quantize_weather
+from .inference import encode_wardrobe, plan_outfits, plan_recommendations, score_plans
+from .scoring import CHUNK_SIZE, ITEM_FEATURES, n_combos
+
+# Weather buckets kept per user (least recently used bucket is dropped first)
+MAX_BUCKETS_PER_USER = 8
+# Users kept in the index (least recently used user is dropped first)
+MAX_USERS = 256
+# Best combinations kept per bucket (reads of up to this many outfits need no scoring)
+TOP_N = 50
+
+# Item columns the index keeps for every wardrobe item
+ITEM_COLUMNS = ["item_id", "type"] + [c for c in ITEM_FEATURES if c != "type"] + ["favorite"]
+
+
+# Wardrobe rows as {column: value} dictionaries with the columns the index keeps
+def _item_rows(wardrobe_df):
+    if wardrobe_df.empty or any(c not in wardrobe_df.columns for c in ITEM_COLUMNS):
+        return []
+    return wardrobe_df[ITEM_COLUMNS].to_dict("records")
+
+
+# Score below which a best-first list of n combinations out of total was cut off (None: nothing was)
+def _cutoff(best, n, total):
+    return best[n - 1][1] if len(best) >= n and total > n else None
+
+
+# Plan limited to the combinations that contain one item of the given slot
+def _restrict(plan, slot, item_id):
+    i = plan["ids"][slot].index(item_id)
+    codes, favorites = plan["slots"][slot]
+    slots = dict(plan["slots"], **{slot: (codes[i:i + 1], favorites[i:i + 1])})
+    ids = dict(plan["ids"], **{slot: [item_id]})
+    return dict(plan, slots=slots, ids=ids)
+
+
+    # Incrementally maintained per-user index of the best outfit combinations.
+    # - For every weather bucket of a user it keeps the top_n combinations (not the whole
+    #   cartesian product), scored chunk by chunk like recommend_outfits
+    # - Adding an item scores only the combinations that contain it and merges their best
+    # - Deleting an item drops the kept combinations that contain it; the rest is still the
+    #   best of what remains, and a bucket left with fewer than top_k is scored again
+    # - A bucket records the score its list was cut off at ("floor"): combinations never kept
+    #   may score up to it, so combinations merged in later are only kept above it
+    # - Reading recommendations is a lookup of the kept combinations
+    # Combinations of a bucket are scored with the bucket's centre weather, so every
+    # entry of a bucket is comparable; the outfit shape (skirts, outerwear) comes from
+    # the bucket key, which never straddles a temperature threshold.
+
+class OutfitIndex:
+    def __init__(self, model, vocab, buckets=WEATHER_BUCKETS, max_buckets=MAX_BUCKETS_PER_USER,
+                 max_users=MAX_USERS, top_n=TOP_N, chunk_size=CHUNK_SIZE, top_m=None,
+                 beam_width=None):
+        self.model = model
+        self.vocab = vocab
+        self.buckets = buckets
+        self.max_buckets = max_buckets
+        self.max_users = max_users
+        self.top_n = top_n
+        self.chunk_size = chunk_size
+        self.top_m = top_m  # rule-based cascade, see network/cascade.py
+        self.beam_width = beam_width  # beam search over outfit pieces, see network/beam.py
+        self.users = OrderedDict()  # user_id -> {"items": {item_id: row}, "buckets": OrderedDict, "lock"}
+        self.lock = threading.Lock()
+
+    # Top-k outfits for a user's wardrobe and weather as (outer_id, top_id, bottom_id, score)
+    # The stored items are first reconciled with wardrobe_df, scoring only what changed
+    def recommend(self, user_id, wardrobe_df, weather, top_k=5):
+        rows = _item_rows(wardrobe_df)
+        if not rows:
+            return []
+        user = self._user(user_id)
+        with user["lock"]:
+            current = {row["item_id"]: row for row in rows}
+            for item_id in [i for i, row in user["items"].items() if current.get(i) != row]:
+                self._remove(user_id, user, item_id)
+            for item_id in [i for i, row in current.items() if user["items"].get(i) != row]:
+                self._add(user_id, user, current[item_id])
+
+            key = quantize_weather(weather, self.buckets)
+            bucket = user["buckets"].get(key)
+            if bucket is None or (len(bucket["best"]) < top_k and bucket["floor"] is not None):
+                bucket = user["buckets"][key] = self._build_bucket(user_id, user["items"], key, top_k)
+                while len(user["buckets"]) > self.max_buckets:
+                    user["buckets"].popitem(last=False)
+            user["buckets"].move_to_end(key)
+            return [(*combo, score) for combo, score in bucket["best"][:top_k]]
+
+    # Score the combinations of a new item (e.g. from /add_item) in every stored bucket
+    def add_item(self, user_id, item):
+        user = self._user(user_id, create=False)
+        if user is not None:
+            with user["lock"]:
+                row = {c: item[c] for c in ITEM_COLUMNS}
+                if user["items"].get(row["item_id"]) != row:
+                    self._remove(user_id, user, row["item_id"])
+                    self._add(user_id, user, row)
+
+    # Drop the combinations of a deleted item from every stored bucket
+    def remove_item(self, user_id, item_id):
+        user = self._user(user_id, create=False)
+        if user is not None:
+            with user["lock"]:
+                self._remove(user_id, user, item_id)
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            self.users.pop(user_id, None)
+
+    def _user(self, user_id, create=True):
+        with self.lock:
+            if user_id not in self.users:
+                if not create:
+                    return None
+                self.users[user_id] = {"items": {}, "buckets": OrderedDict(), "lock": threading.Lock()}
+                while len(self.users) > self.max_users:
+                    self.users.popitem(last=False)
+            self.users.move_to_end(user_id)
+            return self.users[user_id]
+
+    def _add(self, user_id, user, row):
+        user["items"][row["item_id"]] = row
+        for key, bucket in user["buckets"].items():
+            plan = self._plan(user_id, user["items"], key)
+            if plan is None or plan["has_outer"] != bucket["has_outer"]:
+                # outfit shape changed (e.g. first coat in cold weather): rebuild the bucket
+                user["buckets"][key] = self._build_bucket(user_id, user["items"], key, bucket["n"])
+                continue
+            n = bucket["n"]
+            for slot, ids in plan["ids"].items():
+                if row["item_id"] in ids:
+                    restricted = _restrict(plan, slot, row["item_id"])
+                    scored = self._score(restricted, n)
+                    best = sorted(bucket["best"] + scored, key=lambda entry: entry[1], reverse=True)
+                    floors = [f for f in (bucket["floor"], _cutoff(scored, n, n_combos(restricted["slots"])),
+                                          _cutoff(best, n, len(best))) if f is not None]
+                    bucket["floor"] = max(floors, default=None)
+                    if bucket["floor"] is not None:
+                        best = [entry for entry in best if entry[1] >= bucket["floor"]]
+                    bucket["best"] = best[:n]
+
+    def _remove(self, user_id, user, item_id):
+        if user["items"].pop(item_id, None) is None:
+            return
+        for key, bucket in user["buckets"].items():
+            plan = self._plan(user_id, user["items"], key)
+            if plan is None or plan["has_outer"] != bucket["has_outer"]:
+                user["buckets"][key] = self._build_bucket(user_id, user["items"], key, bucket["n"])
+                continue
+            bucket["best"] = [(combo, s) for combo, s in bucket["best"] if item_id not in combo]
+
+    # Best combinations of a bucket; floor is None if scoring again cannot find more of them
+    # (all its combinations, or all the cascade lets through)
+    def _build_bucket(self, user_id, items, key, top_k=0):
+        n = max(self.top_n, top_k)
+        plan = self._plan(user_id, items, key)
+        if plan is None:
+            return {"has_outer": None, "n": n, "floor": None, "best": []}
+        best = self._score(plan, n)
+        return {"has_outer": plan["has_outer"], "n": n, "floor": _cutoff(best, n, n_combos(plan["slots"])),
+                "best": best}
+
+    # Plan of all allowed combinations for the bucket's centre weather and outfit shape
+    def _plan(self, user_id, items, key):
+        if not items:
+            return None
+        wardrobe_df = pd.DataFrame(list(items.values()))
+        wardrobe_df["user_id"] = user_id
+        encoded = encode_wardrobe(self.vocab, wardrobe_df, user_id)
+        if encoded is None:
+            return None
+        weather = {name: value * size for (name, size), value in zip(self.buckets.items(), key)}
+        return plan_outfits(self.vocab, encoded, user_id, weather, shape=key[len(self.buckets):])
+
+    # Best n combinations of a plan as [((outer_id, top_id, bottom_id), score)], highest first
+    # Scored in chunks, so memory depends on chunk_size and n, not on the size of the plan
+    def _score(self, plan, n):
+        [(scores, best)] = score_plans(self.model, self.vocab, [plan], n, chunk_size=self.chunk_size,
+                                       top_m=self.top_m, beam_width=self.beam_width)
+        return [((outer, top, bottom), score) for outer, top, bottom, score in plan_recommendations(plan, scores, best)]
@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+import torch
+from .cache import CACHE_SIZE, CACHE_TTL, WEATHER_BUCKETS, EncodedWardrobeCache, RecommendationCache
+from .outfit_index import OutfitIndex
+from .scheduler import BATCH_WINDOW, MAX_BATCH_SIZE, InferenceScheduler
+
+# Loaded versions kept in memory (the active and the previous one are never dropped)
+MAX_VERSIONS = 3
+# Candidate rows of the synthetic warm-up batch
+WARMUP_ROWS = 1024
+
+
+# Synthetic batch of valid model inputs, used to warm up a freshly loaded model
+def warmup_inputs(vocab, rows=WARMUP_ROWS):
+    cat = torch.stack([torch.randint(len(vocab.categories[col]), (rows,)) for col in vocab.cat_features], 1)
+    num = torch.rand(rows, len(vocab.numeric_features))
+    return cat, num
+
+
+    # One loaded checkpoint with everything that depends on it.
+    # Requests read the active version once and use its objects until they finish,
+    # so a swap never mixes two models (or vocabularies) within one request.
+
+class ModelVersion:
+    def __init__(self, name, path, options):
+        self.name = name
+        self.path = path
+        self.options = options  # extra load_model arguments (e.g. variant, student)
+        self.status = "loading"  # -> "ready" / "failed"
+        self.error = None
+        self.loaded_at = None
+        self.load_seconds = None
+        self.warmup_ms = None
+        self.model = self.vocab = self.scheduler = None
+        self.recommendation_cache = self.encoded_wardrobes = self.outfit_index = None
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "path": self.path,
+            "options": self.options,
+            "status": self.status,
+            "error": self.error,
+            "vocabulary": self.vocab.version if self.vocab is not None else None,
+            "loaded_at": self.loaded_at,
+            "load_seconds": self.load_seconds,
+            "warmup_ms": self.warmup_ms,
+        }
+
+
+    # Registry of loaded model versions with atomic hot swap.
+    # - load() reads a checkpoint and its vocabulary in a background thread, builds the
+    #   scheduler, caches and outfit index of the version and warms the model up with a
+    #   synthetic batch; only then can the version be activated
+    # - activate() swaps the active version with a single reference assignment;
+    #   in-flight requests finish on the version they started with
+    # - rollback() re-activates the previously active version
+    # - Versions above max_versions are retired (oldest first)
+
+class ModelRegistry:
+    def __init__(self, loader, window=BATCH_WINDOW, max_batch_size=MAX_BATCH_SIZE, cache_size=CACHE_SIZE,
+                 cache_ttl=CACHE_TTL, buckets=WEATHER_BUCKETS, max_versions=MAX_VERSIONS, top_m=None,
+                 beam_width=None, encoded_cache_size=CACHE_SIZE):
+        self.loader = loader  # loader(path, **options) -> (model, vocab), e.g. load_model
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.encoded_cache_size = encoded_cache_size  # users per EncodedWardrobeCache (0: off)
+        self.buckets = buckets
+        self.max_versions = max_versions
+        self.top_m = top_m  # cascade size of the outfit indexes (see network/cascade.py)
+        self.beam_width = beam_width  # beam width of the outfit indexes (see network/beam.py)
+
+        self.versions = {}  # name -> ModelVersion, in load order
+        self.history = []  # names of the versions activated so far, latest last
+        self.active = None
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    # Start loading a checkpoint in the background; returns the new version's name
+    # activate=True swaps it in as soon as it is ready
+    def load(self, path, activate=True, **options):
+        version = self._register(path, options)
+        threading.Thread(target=self._load, args=(version, activate), name=f"model-load-{version.name}",
+                         daemon=True).start()
+        return version.name
+
+    # Load a checkpoint in the calling thread (e.g. at startup); raises if loading fails
+    def load_now(self, path, activate=True, **options):
+        version = self._register(path, options)
+        self._load(version, activate)
+        if version.status == "failed":
+            raise RuntimeError(f"Could not load model version {version.name} from {path}: {version.error}")
+        return version.name
+
+    def activate(self, name):
+        with self.lock:
+            version = self.versions.get(name)
+            if version is None:
+                raise KeyError(f"Unknown model version '{name}'")
+            if version.status != "ready":
+                raise ValueError(f"Model version '{name}' is {version.status}, not ready")
+            if self.active is not version:
+                self.active = version
+                self.history.append(name)
+            retired = self._retire()
+        for old in retired:
+            old.scheduler.close()
+        return version
+
+    # Activate the version that was active before the current one
+    def rollback(self):
+        with self.lock:
+            current = self.active.name if self.active is not None else None
+            previous = [name for name in reversed(self.history) if name != current and name in self.versions]
+        if not previous:
+            raise ValueError("No previous model version to roll back to")
+        return self.activate(previous[0])
+
+    def list(self):
+        with self.lock:
+            active = self.active.name if self.active is not None else None
+            return {"active": active, "versions": [v.describe() for v in self.versions.values()]}
+
+    # Forget cached results of a user in every loaded version (their items changed)
+    def invalidate_user(self, user_id):
+        with self.lock:
+            ready = [v for v in self.versions.values() if v.status == "ready"]
+        for version in ready:
+            version.recommendation_cache.invalidate_user(user_id)
+            version.encoded_wardrobes.invalidate_user(user_id)
+
+    def close(self):
+        with self.lock:
+            ready = [v for v in self.versions.values() if v.status == "ready"]
+        for version in ready:
+            version.scheduler.close()
+
+    def _register(self, path, options):
+        with self.lock:
+            self.counter += 1
+            version = ModelVersion(f"v{self.counter}", path, options)
+            self.versions[version.name] = version
+        return version
+
+    def _load(self, version, activate):
+        start = time.perf_counter()
+        try:
+            model, vocab = self.loader(version.path, **version.options)
+            warmup_ms = self._warmup(model, vocab)
+        except Exception as e:
+            version.status, version.error = "failed", f"{type(e).__name__}: {e}"
+            print(f"Loading model version {version.name} from {version.path} failed: {version.error}")
+            return
+
+        version.model, version.vocab, version.warmup_ms = model, vocab, warmup_ms
+        version.scheduler = InferenceScheduler(model, window=self.window, max_batch_size=self.max_batch_size)
+        version.recommendation_cache = RecommendationCache(max_size=self.cache_size, ttl=self.cache_ttl,
+                                                           buckets=self.buckets)
+        version.encoded_wardrobes = EncodedWardrobeCache(max_users=self.encoded_cache_size)
+        version.outfit_index = OutfitIndex(version.scheduler, vocab, buckets=self.buckets, top_m=self.top_m,
+                                           beam_width=self.beam_width)
+        version.loaded_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        version.load_seconds = time.perf_counter() - start
+        version.status = "ready"
+        print(f"Model version {version.name} ({os.path.basename(version.path)}) ready in "
+              f"{version.load_seconds:.2f}s, warm-up {warmup_ms:.1f} ms")
+        if activate:
+            self.activate(version.name)
+
+    # Run the synthetic batch a few times (TorchScript optimizes on the first calls)
+    # and reject models that produce non-finite scores
+    def _warmup(self, model, vocab, runs=3):
+        cat, num = warmup_inputs(vocab)
+        with torch.no_grad():
+            for _ in range(runs):
+                start = time.perf_counter()
+                scores = model(cat, num)
+        if not torch.isfinite(scores).all():
+            raise ValueError("model produced non-finite scores on the warm-up batch")
+        return 1000 * (time.perf_counter() - start)
+
+    # Drop the oldest loaded versions above max_versions, keeping the active and previous one
+    # Requests still holding a dropped version finish on it (its scheduler scores directly)
+    def _retire(self):
+        keep = set(self.history[-2:])
+        ready = [v for v in self.versions.values() if v.status == "ready"]
+        retired = [v for v in ready if v.name not in keep][:max(0, len(ready) - self.max_versions)]
+        for version in retired:
+            del self.versions[version.name]
+        return retired
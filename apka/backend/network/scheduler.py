@@ -0,0 +1,151 @@
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+import torch
+
+# How long (seconds) the worker waits for more requests before running a batch
+BATCH_WINDOW = 0.002
+# Maximum number of candidate rows merged into one forward pass
+MAX_BATCH_SIZE = 8192
+
+# Live schedulers, restarted in a forked child by one module-level fork hook
+# (a hook per scheduler could not be unregistered and would keep every retired
+# scheduler, and its model, in memory)
+_schedulers = weakref.WeakSet()
+
+
+def _after_fork():
+    for scheduler in list(_schedulers):
+        scheduler._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+    # Dynamic micro-batching inference worker shared by concurrent requests.
+    # - Requests put their candidate tensors on a queue and wait for their scores
+    # - A single worker thread merges whatever arrived within the batch window
+    #   (or up to MAX_BATCH_SIZE rows) into one forward pass
+    # - Called like the model itself: scheduler(cat, num) -> scores, so it can be
+    #   passed to recommend_outfits in place of the model
+    # - Fork safe: a forked child (see serve.py) starts its own queue and worker,
+    #   since threads do not survive fork
+    # - After close(), calls run the model directly (e.g. requests still holding a
+    #   model version the registry has retired)
+
+class InferenceScheduler:
+    def __init__(self, net, window=BATCH_WINDOW, max_batch_size=MAX_BATCH_SIZE):
+        self.net = net
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._start()
+        _schedulers.add(self)
+
+    # Fresh queue, statistics and worker thread
+    def _start(self):
+        self.queue = queue.Queue()
+        self.closing = threading.Lock()
+        self.closed = False
+
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.rows = 0
+        self.max_rows = 0
+        self.histogram = {}  # requests per batch (power-of-two buckets) -> number of batches
+
+        self.worker = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self.worker.start()
+
+    def _after_fork(self):
+        if not self.closed:
+            self._start()
+
+    # Score one request's candidates; blocks until its batch has been run
+    def __call__(self, cat, num):
+        future = Future()
+        with self.closing:
+            closed = self.closed
+            if not closed:
+                self.queue.put((cat, num, future))
+        if closed:
+            with torch.no_grad():
+                return self.net(cat, num)
+        return future.result()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self.queue.get()
+            if first is None:
+                break
+            batch = [first]
+            rows = len(first[0])
+
+            # Collect more requests until the window closes or the batch is full
+            deadline = time.monotonic() + self.window
+            while rows < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                rows += len(item[0])
+
+            self._score(batch)
+
+    def _score(self, batch):
+        cats, nums, futures = zip(*batch)
+        try:
+            with torch.no_grad():
+                scores = self.net(torch.cat(cats), torch.cat(nums))
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        offset = 0
+        for cat, future in zip(cats, futures):
+            future.set_result(scores[offset:offset + len(cat)])
+            offset += len(cat)
+        self._record(len(batch), offset)
+
+    def _record(self, n_requests, n_rows):
+        bucket = 1 << (n_requests - 1).bit_length()
+        with self.lock:
+            self.batches += 1
+            self.requests += n_requests
+            self.rows += n_rows
+            self.max_rows = max(self.max_rows, n_rows)
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    # Queue depth and batch-size statistics
+    def stats(self):
+        with self.lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "batches": self.batches,
+                "requests": self.requests,
+                "rows": self.rows,
+                "mean_requests_per_batch": self.requests / self.batches if self.batches else 0.0,
+                "mean_rows_per_batch": self.rows / self.batches if self.batches else 0.0,
+                "max_rows_per_batch": self.max_rows,
+                "requests_per_batch_histogram": dict(sorted(self.histogram.items())),
+            }
+
+    # Stop the worker once the requests already queued have been served
+    def close(self):
+        with self.closing:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.put(None)
+        self.worker.join()
@@ -0,0 +1,229 @@
+import numpy as np
+import torch
+
+# Attributes describing a single clothing item, in the order used by the
+# "<slot>_<attribute>" categorical columns of the training data
+ITEM_FEATURES = ["type", "color", "material", "size", "style", "special_property"]
+
+# Maximum number of outfit combinations sent through the model in one forward pass
+CHUNK_SIZE = 4096
+
+# Temperatures (degrees C) at which the allowed outfits change: below NO_SKIRTS_BELOW
+# skirts and shorts are left out, below OUTERWEAR_BELOW outerwear is added
+NO_SKIRTS_BELOW = 15
+OUTERWEAR_BELOW = 18
+
+
+# Outfit shape a temperature leads to: (skirts and shorts left out, outerwear wanted)
+def outfit_shape(temperature):
+    return temperature < NO_SKIRTS_BELOW, temperature < OUTERWEAR_BELOW
+
+
+# Encode the attributes of every item of one slot ("top", "outer" or "bottom")
+# Returns a [n_items, len(ITEM_FEATURES)] tensor of category codes
+# items=None encodes a single "missing" item (outfit without outerwear)
+def encode_items(items, slot, vocab):
+    codes = []
+    for c in ITEM_FEATURES:
+        encoder = vocab.encoders[f"{slot}_{c}"]
+        # unknown values fall back to "missing"
+        codes.append(encoder.encode(["missing"] if items is None else items[c]))
+    return torch.tensor(np.stack(codes, axis=1), dtype=torch.long)
+
+
+# Encode the items of one slot once
+# Returns (codes, favorites); items=None gives a single "missing" item
+def encode_slot(items, slot, vocab):
+    if items is None:
+        return encode_items(None, slot, vocab), torch.zeros(1)
+    favorites = torch.tensor(items["favorite"].values.astype(float), dtype=torch.float32)
+    return encode_items(items, slot, vocab), favorites
+
+
+# Slot indices of the outfit combinations flat[i]
+# Combinations are enumerated in the same order as itertools.product(outers, tops, bottoms)
+def combo_index(slots, flat):
+    n_top, n_bottom = len(slots["top"][0]), len(slots["bottom"][0])
+    return {
+        "outer": flat // (n_top * n_bottom),
+        "top": (flat // n_bottom) % n_top,
+        "bottom": flat % n_bottom,
+    }
+
+
+# Number of outfit combinations for the encoded slots
+def n_combos(slots):
+    return len(slots["outer"][0]) * len(slots["top"][0]) * len(slots["bottom"][0])
+
+
+# Candidate matrix for the outfit combinations flat[i]
+# Returns (cat [N, n_cat_features], num [N, 7]) in the layout RecommenderNet expects
+def candidate_chunk(slots, flat, weather, vocab, has_outer):
+    index = combo_index(slots, flat)
+
+    # Place each slot's codes into the columns the model expects
+    cat = torch.empty((len(flat), len(vocab.cat_features)), dtype=torch.long)
+    for j, col in enumerate(vocab.cat_features):
+        slot, attr = col.split("_", 1)
+        cat[:, j] = slots[slot][0][index[slot], ITEM_FEATURES.index(attr)]
+
+    num = torch.empty((len(flat), 7), dtype=torch.float32)
+    num[:, 0] = weather["temperature"]
+    num[:, 1] = weather["rain"]
+    num[:, 2] = weather["wind"]
+    num[:, 3] = slots["top"][1][index["top"]]
+    num[:, 4] = slots["bottom"][1][index["bottom"]]
+    num[:, 5] = slots["outer"][1][index["outer"]]
+    num[:, 6] = 1.0 if has_outer else 0.0
+    return cat, num
+
+
+# Scores chunks of combinations with one batched forward pass per chunk
+# features() builds the model inputs for a chunk, head() runs the model on them;
+# keeping the two apart lets inputs of several users share a forward pass
+class ForwardScorer:
+    def __init__(self, model, slots, weather, vocab, has_outer):
+        self.model = model
+        self.slots = slots
+        self.weather = weather
+        self.vocab = vocab
+        self.has_outer = has_outer
+
+    def features(self, flat):
+        return candidate_chunk(self.slots, flat, self.weather, self.vocab, self.has_outer)
+
+    def head(self, cat, num):
+        return self.model(cat, num)
+
+    def __call__(self, flat):
+        return self.head(*self.features(flat))
+
+
+# Indices of the k best scores, highest first
+# Ties keep candidate order, so the result matches a stable sort of all scores
+def select_top_k(scores, k):
+    k = min(k, len(scores))
+    if k == 0:
+        return torch.empty(0, dtype=torch.long)
+    threshold = torch.topk(scores, k).values[-1]
+    idx = torch.nonzero(scores >= threshold).squeeze(1)
+    order = torch.sort(scores[idx], descending=True, stable=True).indices
+    return idx[order][:k]
+
+
+# Positions of the per-slot favourite flags in the numeric feature vector
+# (temperature, rain, wind, top_favorite, bottom_favorite, outer_favorite, has_outer)
+FAVORITE_COLUMN = {"top": 3, "bottom": 4, "outer": 5}
+HAS_OUTER_COLUMN = 6
+
+
+# First-layer contribution of every item of every slot
+# The first nn.Linear of RecommenderNet sees the concatenation of independent
+# per-slot embeddings and numeric features, so W @ x + b splits into
+# top + outer + bottom + weather parts that can be computed once per item
+def item_activations(model, slots, weather, vocab, has_outer):
+    first = model.model[0]
+    offsets = np.cumsum([0] + [emb.embedding_dim for emb in model.embeddings])
+    num_weight = first.weight[:, offsets[-1]:]
+
+    parts = {}
+    for slot, (codes, favs) in slots.items():
+        act = favs[:, None] * num_weight[:, FAVORITE_COLUMN[slot]]
+        for j, col in enumerate(vocab.cat_features):
+            col_slot, attr = col.split("_", 1)
+            if col_slot != slot:
+                continue
+            emb = model.embeddings[j](codes[:, ITEM_FEATURES.index(attr)])
+            act = act + emb @ first.weight[:, offsets[j]:offsets[j + 1]].T
+        parts[slot] = act
+
+    if has_outer:
+        parts["outer"] = parts["outer"] + num_weight[:, HAS_OUTER_COLUMN]
+    weather_vals = torch.tensor([weather["temperature"], weather["rain"], weather["wind"]], dtype=torch.float32)
+    parts["weather"] = first.bias + num_weight[:, :3] @ weather_vals
+    return parts
+
+
+# Scores chunks of combinations using the factorized first layer
+# Each combination costs a gather-add of three precomputed vectors plus the
+# small MLP tail instead of a full forward pass
+class FactorizedScorer:
+    def __init__(self, model, slots, weather, vocab, has_outer):
+        self.slots = slots
+        with torch.no_grad():
+            self.parts = item_activations(model, slots, weather, vocab, has_outer)
+        self.tail = model.model[1:]
+
+    def features(self, flat):
+        index = combo_index(self.slots, flat)
+        hidden = (self.parts["outer"][index["outer"]] + self.parts["top"][index["top"]]
+                  + self.parts["bottom"][index["bottom"]] + self.parts["weather"])
+        return (hidden,)
+
+    def head(self, hidden):
+        return self.tail(hidden).squeeze(1)
+
+    def __call__(self, flat):
+        return self.head(*self.features(flat))
+
+
+# Add a chunk of scored combinations to the running top-k
+# The running entries always come from earlier chunks and are already ordered by
+# score (ties by enumeration order), so concatenating keeps ties in enumeration order
+def merge_top_k(best_scores, best_flat, scores, flat, k):
+    scores = torch.cat([best_scores, scores])
+    flat = torch.cat([best_flat, flat])
+    keep = select_top_k(scores, k)
+    return scores[keep], flat[keep]
+
+
+# Split the combinations of several scorers into shared batches of up to chunk_size rows
+# Yields lists of (scorer index, start, stop) segments
+def packed_batches(totals, chunk_size):
+    batch, room = [], chunk_size
+    for i, total in enumerate(totals):
+        start = 0
+        while start < total:
+            stop = min(total, start + room)
+            batch.append((i, start, stop))
+            room -= stop - start
+            start = stop
+            if room == 0:
+                yield batch
+                batch, room = [], chunk_size
+    if batch:
+        yield batch
+
+
+# Score the combinations of several scorers (e.g. several users) in shared batches,
+# keeping only a running top-k per scorer
+# All scorers must be of the same kind and wrap the same model
+# Returns a list of (scores, flat indices) of the k best combinations, highest first
+def stream_top_k_packed(scorers, totals, k, chunk_size=CHUNK_SIZE):
+    best = [(torch.empty(0), torch.empty(0, dtype=torch.long)) for _ in scorers]
+    with torch.no_grad():
+        for batch in packed_batches(totals, chunk_size):
+            features = [scorers[i].features(torch.arange(start, stop)) for i, start, stop in batch]
+            scores = scorers[batch[0][0]].head(*[torch.cat(parts) for parts in zip(*features)])
+            offset = 0
+            for i, start, stop in batch:
+                chunk = scores[offset:offset + stop - start]
+                best[i] = merge_top_k(*best[i], chunk, torch.arange(start, stop), k)
+                offset += stop - start
+    return best
+
+
+# Score `total` combinations chunk by chunk, keeping only the running top-k
+# Peak memory depends on chunk_size and k, not on the size of the cartesian product
+# Returns (scores, flat indices) of the k best combinations, highest first
+def stream_top_k(score, total, k, chunk_size=CHUNK_SIZE):
+    return stream_top_k_packed([score], [total], k, chunk_size)[0]
+
+
+# Scores of all `total` combinations, computed chunk by chunk
+def score_all(score, total, chunk_size=CHUNK_SIZE):
+    scores = []
+    with torch.no_grad():
+        for start in range(0, total, chunk_size):
+            scores.append(score(torch.arange(start, min(start + chunk_size, total))))
+    return torch.cat(scores) if scores else torch.empty(0)
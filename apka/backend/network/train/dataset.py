@@ -3,11 +3,12 @@ import numpy as np
 from sklearn.preprocessing import LabelEncoder
 import torch
 from torch.utils.data import Dataset
+from .encoder import CategoryEncoder
 
     # PyTorch Dataset for training the outfit scoring model.
 
     # - Loads a CSV file containing top/bottom/outer outfit combinations.
-    # - Encodes categorical features with LabelEncoder.
+    # - Encodes categorical features with LabelEncoder classes compiled into CategoryEncoders.
     # - Prepares numerical features such as temperature, rain, favorites, etc.
     # - Provides tensors for model training.
     
@@ -37,13 +38,14 @@ class FashionDataset(Dataset):
             self.encoded[col] = self.encoded[col].fillna('missing').astype(str)
             le = LabelEncoder()
             le.fit(self.encoded[col])
-            self.encoders[col] = le
+            self.encoders[col] = CategoryEncoder(le.classes_)
             # Replace original values with their integer encoding
-            self.encoded[col] = le.transform(self.encoded[col])
+            self.encoded[col] = self.encoders[col].encode(self.encoded[col])
 
         # Numeric features (temperature, rain, wind, favorites, has_outer flag)
-        self.numeric = self.df[['temperature', 'rain_chance', 'wind_speed',
-                                'top_favorite', 'bottom_favorite', 'outer_favorite', 'has_outer']].values.astype(float)
+        self.numeric_features = ['temperature', 'rain_chance', 'wind_speed',
+                                 'top_favorite', 'bottom_favorite', 'outer_favorite', 'has_outer']
+        self.numeric = self.df[self.numeric_features].values.astype(float)
         self.labels = self.df['score'].values.astype(float)
 
         # User_id
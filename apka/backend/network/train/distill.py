@@ -0,0 +1,170 @@
+# Distillation of RecommenderNet into the compact StudentNet.
+# The teacher scores every outfit combination of synthetic wardrobes
+# (DataGenerator.generate_synthetic_data) under random weather, and the student is
+# trained to reproduce those scores. Run from apka/backend:
+#   python -m network.train.distill network/final_version.pth
+# The student is saved next to the teacher (final_version.student.pth) and served
+# with load_model(..., student=True). --report-only compares an existing student.
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+from .model import StudentNet, student_path
+from ..inference import encode_wardrobe, load_model, plan_outfits
+from ..scoring import CHUNK_SIZE, candidate_chunk, n_combos, score_all, select_top_k
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from data.raw_data.DataGenerator import generate_synthetic_data
+
+# Parameters
+BATCH_SIZE = 512
+EPOCHS = 20
+LEARNING_RATE = 0.002
+EMB_DIM = 4
+HIDDEN = (32, 16)
+USERS = 400  # synthetic wardrobes used for training
+WEATHERS_PER_USER = 8
+REPORT_USERS = 50  # held-out synthetic wardrobes used for the report
+
+# Range of the random weather (temperature in degrees C, % rain chance, wind)
+WEATHER_RANGE = {"temperature": (-10.0, 35.0), "rain": (0.0, 100.0), "wind": (0.0, 40.0)}
+
+
+# Plans (all allowed combinations) of synthetic wardrobes under random weather
+def synthetic_plans(vocab, num_users, weathers_per_user, seed):
+    wardrobe = generate_synthetic_data(num_users, min_tops=5, min_outers=2, min_bottoms=5, min_others=0, seed=seed)
+    rng = np.random.default_rng(seed)
+    plans = []
+    for user_id, items in wardrobe.groupby("user_id"):
+        encoded = encode_wardrobe(vocab, items, user_id)
+        if encoded is None:
+            continue
+        for _ in range(weathers_per_user):
+            weather = {name: float(rng.uniform(low, high)) for name, (low, high) in WEATHER_RANGE.items()}
+            plan = plan_outfits(vocab, encoded, user_id, weather)
+            if plan is not None:
+                plans.append(plan)
+    return plans
+
+
+# Model inputs of every combination of a plan
+def plan_inputs(plan, vocab):
+    flat = torch.arange(n_combos(plan["slots"]))
+    return candidate_chunk(plan["slots"], flat, plan["weather"], vocab, plan["has_outer"])
+
+
+# Training set of (cat, num, teacher score) rows
+def distillation_data(teacher, vocab, plans):
+    cat, num = (torch.cat(parts) for parts in zip(*[plan_inputs(plan, vocab) for plan in plans]))
+    target = score_all(lambda flat: teacher(cat[flat], num[flat]), len(cat), CHUNK_SIZE)
+    return TensorDataset(cat, num, target)
+
+
+def train_student(student, data, epochs=EPOCHS, lr=LEARNING_RATE):
+    loader = DataLoader(data, batch_size=BATCH_SIZE, shuffle=True)
+    optimizer = torch.optim.Adam(student.parameters(), lr=lr)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, epochs)
+    criterion = torch.nn.MSELoss()
+
+    for epoch in range(epochs):
+        student.train()
+        train_loss = 0
+        for cat, num, target in loader:
+            optimizer.zero_grad()
+            loss = criterion(student(cat, num), target)
+            loss.backward()
+            optimizer.step()
+            train_loss += loss.item()
+        scheduler.step()
+        print(f"Epoch {epoch + 1}/{epochs}- Distillation Loss: {train_loss / len(loader):.4f}")
+    student.eval()
+    return student
+
+
+# Mean time (ms) of one forward pass over batch_size candidate rows
+def forward_ms(model, vocab, batch_size, repeats=50):
+    cat = torch.stack([torch.randint(len(vocab.categories[col]), (batch_size,)) for col in vocab.cat_features], 1)
+    num = torch.rand(batch_size, len(vocab.numeric_features))
+    with torch.no_grad():
+        model(cat, num)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(cat, num)
+    return 1000 * (time.perf_counter() - start) / repeats
+
+
+# Ranking agreement of student and teacher on held-out plans, and per-forward CPU speedup
+def distillation_report(teacher, student, vocab, plans, top_k=5, batch_sizes=(64, 512, CHUNK_SIZE)):
+    overlap, identical, spearman = [], [], []
+    with torch.no_grad():
+        for plan in plans:
+            cat, num = plan_inputs(plan, vocab)
+            expected, actual = teacher(cat, num), student(cat, num)
+            best_expected = select_top_k(expected, top_k).tolist()
+            best_actual = select_top_k(actual, top_k).tolist()
+            overlap.append(len(set(best_expected) & set(best_actual)) / len(best_expected))
+            identical.append(best_expected == best_actual)
+            if len(cat) > 1:
+                ranks = [torch.argsort(torch.argsort(s)).float() for s in (expected, actual)]
+                spearman.append(torch.corrcoef(torch.stack(ranks))[0, 1].item())
+
+    speed = {}
+    for batch_size in batch_sizes:
+        teacher_ms, student_ms = forward_ms(teacher, vocab, batch_size), forward_ms(student, vocab, batch_size)
+        speed[batch_size] = {"teacher_ms": teacher_ms, "student_ms": student_ms, "speedup": teacher_ms / student_ms}
+
+    return {
+        "plans": len(plans),
+        "top_k_overlap": float(np.mean(overlap)),
+        "top_k_identical": float(np.mean(identical)),
+        "spearman": float(np.mean(spearman)),
+        "teacher_parameters": sum(p.numel() for p in teacher.parameters()),
+        "student_parameters": sum(p.numel() for p in student.parameters()),
+        "speed": speed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill RecommenderNet into the compact StudentNet.")
+    parser.add_argument("model_path", help="Teacher checkpoint (.pth) with its .vocab.json next to it")
+    parser.add_argument("--users", type=int, default=USERS, help="Synthetic wardrobes used for training")
+    parser.add_argument("--weathers", type=int, default=WEATHERS_PER_USER, help="Random weathers per wardrobe")
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--emb-dim", type=int, default=EMB_DIM, help="Size of the shared attribute embeddings")
+    parser.add_argument("--hidden", type=int, nargs="+", default=list(HIDDEN), help="Hidden layer sizes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--report-only", action="store_true", help="Only compare the saved student")
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    teacher, vocab = load_model(args.model_path)
+    path = student_path(args.model_path)
+
+    if args.report_only:
+        student, _ = load_model(args.model_path, student=True)
+    else:
+        data = distillation_data(teacher, vocab, synthetic_plans(vocab, args.users, args.weathers, args.seed))
+        print(f"Distilling on {len(data)} scored combinations")
+        config = {"emb_dim": args.emb_dim, "hidden": list(args.hidden)}
+        student = train_student(StudentNet(vocab.categories, len(vocab.numeric_features), **config), data,
+                                args.epochs)
+        torch.save({"model_state_dict": student.state_dict(), "config": config}, path)
+        print(f"Saved student to {path}")
+
+    # held-out wardrobes: a different generator seed
+    plans = synthetic_plans(vocab, REPORT_USERS, WEATHERS_PER_USER, args.seed + 1)
+    report = distillation_report(teacher, student, vocab, plans)
+    print(f"\n{report['plans']} held-out requests: top-k overlap {report['top_k_overlap']:.3f}, "
+          f"identical top-k {report['top_k_identical']:.2f}, Spearman {report['spearman']:.3f}")
+    print(f"Parameters: teacher {report['teacher_parameters']}, student {report['student_parameters']}")
+    for batch_size, row in report["speed"].items():
+        print(f"batch {batch_size:>5}: teacher {row['teacher_ms']:.3f} ms, student {row['student_ms']:.3f} ms "
+              f"({row['speedup']:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
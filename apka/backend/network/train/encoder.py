@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+    # Precompiled categorical encoder.
+    # - Built once from the classes of a fitted LabelEncoder
+    # - Maps a whole column of strings to integer codes with one dictionary lookup pass
+    # - Unknown values (and NaN) fall back to the "missing" category
+    # Used by FashionDataset during training and by inference.
+
+class CategoryEncoder:
+    def __init__(self, classes):
+        self.classes_ = np.asarray(classes, dtype=object)
+        self.codes = {value: code for code, value in enumerate(self.classes_.tolist())}
+        self.missing = self.codes.get("missing")
+
+    # Encode a column (list, numpy array or pandas Series) of category values
+    def encode(self, values):
+        values = pd.Series(values, dtype=object)
+        codes = values.map(self.codes)
+        unknown = codes.isna()
+        if unknown.any():
+            if self.missing is None:
+                raise ValueError(f"Unknown categories {values[unknown].unique().tolist()} "
+                                 f"and no 'missing' category to fall back to")
+            codes = codes.fillna(self.missing)
+        return codes.to_numpy(dtype=np.int64)
+
@@ -1,3 +1,4 @@
+import os
 import torch
 import torch.nn as nn
 
@@ -35,3 +36,61 @@ class RecommenderNet(nn.Module):
         # Concatenate all embeddings, numeric features
         x = torch.cat(emb + [num_data], dim=1)
         return self.model(x).squeeze(1)
+
+
+# Path of the distilled student that belongs to a teacher checkpoint
+# e.g. network/final_version.pth -> network/final_version.student.pth
+def student_path(model_path):
+    return os.path.splitext(model_path)[0] + ".student.pth"
+
+
+    # Embedding table shared by the same attribute of several slots.
+    # Codes of one slot column are mapped to the codes of the shared table first.
+
+class SharedEmbedding(nn.Module):
+    def __init__(self, table, remap):
+        super().__init__()
+        self.table = table
+        self.register_buffer("remap", remap)
+
+    @property
+    def embedding_dim(self):
+        return self.table.embedding_dim
+
+    def forward(self, codes):
+        return self.table(self.remap[codes])
+
+
+    # Compact student of RecommenderNet, trained by network/train/distill.py.
+    # - One embedding table per attribute (type, color, ...) shared by top/outer/bottom
+    # - Narrower MLP
+    # Same inputs, outputs and layout (embeddings + model Sequential) as RecommenderNet,
+    # so scorers, export and quantization work on both.
+
+class StudentNet(nn.Module):
+    def __init__(self, categories, num_input_dim, emb_dim=4, hidden=(32, 16)):
+        super().__init__()
+        # categories: {column: [class, ...]} in the model's categorical feature order (Vocabulary.categories)
+        attributes = {}
+        for col, classes in categories.items():
+            attr = col.split("_", 1)[1]
+            attributes[attr] = sorted(set(attributes.get(attr, [])) | set(classes))
+
+        self.attributes = list(attributes)
+        self.tables = nn.ModuleList([nn.Embedding(len(values), emb_dim) for values in attributes.values()])
+        self.embeddings = nn.ModuleList()
+        for col, classes in categories.items():
+            attr = col.split("_", 1)[1]
+            remap = torch.tensor([attributes[attr].index(value) for value in classes], dtype=torch.long)
+            self.embeddings.append(SharedEmbedding(self.tables[self.attributes.index(attr)], remap))
+
+        layers, width = [], emb_dim * len(categories) + num_input_dim
+        for size in hidden:
+            layers += [nn.Linear(width, size), nn.ReLU()]
+            width = size
+        self.model = nn.Sequential(*layers, nn.Linear(width, 1))
+
+    def forward(self, cat_data, num_data):
+        emb = [emb_layer(cat_data[:, i]) for i, emb_layer in enumerate(self.embeddings)]
+        x = torch.cat(emb + [num_data], dim=1)
+        return self.model(x).squeeze(1)
@@ -2,6 +2,7 @@ import torch
 from torch.utils.data import DataLoader, random_split
 from WAIdrobe.apka.backend.siec.train.dataset import FashionDataset
 from WAIdrobe.apka.backend.siec.train.model import RecommenderNet
+from WAIdrobe.apka.backend.siec.train.vocabulary import Vocabulary, embedding_dims, vocabulary_path
 import os
 
 # Parameters
@@ -33,9 +34,10 @@ train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True, co
 val_loader = DataLoader(val_dataset, batch_size=BATCH_SIZE, shuffle=False, collate_fn=custom_collate_fn)
 
 # Model and optimizer
-cat_dims = [len(enc.classes_) for enc in dataset.encoders.values()]
-emb_dims = [min(50, (dim + 1) // 2) for dim in cat_dims]
-num_input_dim = 7
+vocab = Vocabulary.from_dataset(dataset)
+cat_dims = vocab.cat_dims
+emb_dims = embedding_dims(cat_dims)
+num_input_dim = len(vocab.numeric_features)
 
 model = RecommenderNet(cat_dims, emb_dims, num_input_dim)
 optimizer = torch.optim.Adam(model.parameters(), lr=LEARNING_RATE, weight_decay=WEIGHT_DECAY)
@@ -94,6 +96,9 @@ for epoch in range(EPOCHS):  # run only for the new session
         "optimizer_state_dict": optimizer.state_dict(),
     }, MODEL_PATH)
 
+# Save the vocabulary next to the checkpoint, so inference does not need the training CSV
+vocab.save(vocabulary_path(MODEL_PATH))
+
 # --- Plot 1: Training vs validation loss ---
 plt.figure(figsize=(8,5))
 plt.plot(train_losses, label="Training loss")
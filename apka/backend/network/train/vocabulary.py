@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+from .encoder import CategoryEncoder
+
+
+# Embedding sizes used for categorical columns with the given numbers of categories
+def embedding_dims(cat_dims):
+    return [min(50, (dim + 1) // 2) for dim in cat_dims]
+
+
+# Path of the vocabulary artifact that belongs to a model checkpoint
+# e.g. network/final_version.pth -> network/final_version.vocab.json
+def vocabulary_path(model_path):
+    return os.path.splitext(model_path)[0] + ".vocab.json"
+
+
+    # Compact description of everything the model needs to encode its inputs.
+    # - Categories (LabelEncoder classes) of every categorical column, with their compiled encoders
+    # - Embedding dimensions used by RecommenderNet
+    # - Order of the numeric features
+    # Saved next to the checkpoint by training, so inference does not have to
+    # read the training CSV.
+
+class Vocabulary:
+    def __init__(self, categories, emb_dims, numeric_features):
+        # categories: {column: [class, ...]} in the model's categorical feature order
+        self.cat_features = list(categories)
+        self.categories = {col: list(classes) for col, classes in categories.items()}
+        self.emb_dims = list(emb_dims)
+        self.numeric_features = list(numeric_features)
+
+        # Compiled encoders built straight from the stored classes (no fitting needed)
+        self.encoders = {col: CategoryEncoder(classes) for col, classes in self.categories.items()}
+
+    # Short hash of the categories: changes whenever the codes of any value change
+    @property
+    def version(self):
+        data = json.dumps({"cat_features": self.cat_features, "categories": self.categories}, sort_keys=True)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()[:12]
+
+    @property
+    def cat_dims(self):
+        return [len(self.categories[col]) for col in self.cat_features]
+
+    # Build the vocabulary from a FashionDataset (used by training)
+    @classmethod
+    def from_dataset(cls, dataset):
+        categories = {col: dataset.encoders[col].classes_.tolist() for col in dataset.cat_features}
+        cat_dims = [len(classes) for classes in categories.values()]
+        return cls(categories, embedding_dims(cat_dims), dataset.numeric_features)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        categories = {col: data["categories"][col] for col in data["cat_features"]}
+        return cls(categories, data["emb_dims"], data["numeric_features"])
+
+    def save(self, path):
+        data = {
+            "cat_features": self.cat_features,
+            "categories": self.categories,
+            "emb_dims": self.emb_dims,
+            "numeric_features": self.numeric_features,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
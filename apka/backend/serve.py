@@ -0,0 +1,122 @@
+# Multi-worker serving of main.py with one preloaded model.
+# The parent imports main (model, vocabulary, caches) once and forks the workers,
+# which share the model weights instead of loading their own copy:
+#   python serve.py --workers 4
+# Every worker runs its own uvicorn server on the listening socket of the parent and
+# uses --threads torch threads (default: cores / workers), so workers do not oversubscribe CPUs.
+# The background removal processes of main.py are divided among the workers the same way.
+# With more than one worker the /admin/models writes are refused (409): change MODEL_PATH and
+# restart instead. Encoded wardrobes are then not cached either, so every worker reads the
+# stored item codes of the current wardrobe.
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+import torch
+import uvicorn
+
+
+# Listening socket shared by all workers
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+# Load the app once in the parent, with the model weights in shared memory
+def preload(workers):
+    # forward passes of the parent (e.g. variant checks) stay single-threaded, so no
+    # intra-op thread pool exists yet when the workers are forked
+    torch.set_num_threads(1)
+    import main
+
+    # an /admin/models write (or an item write invalidating cached wardrobes) would only
+    # reach the worker that handles it
+    if workers > 1:
+        main.ADMIN_MODEL_WRITES = False
+        main.ENCODED_CACHE_SIZE = 0
+    # every worker starts its own background removal pool (on its first upload): share the
+    # cores among them instead of starting cores x workers segmenting processes
+    main.BACKGROUND_PROCESSES = max(1, main.BACKGROUND_PROCESSES // workers)
+    main.BACKGROUND_MAX_PENDING = max(1, main.BACKGROUND_MAX_PENDING // workers)
+    main.BACKGROUND_THREADS = (main.BACKGROUND_THREADS
+                               or max(1, os.cpu_count() // (workers * main.BACKGROUND_PROCESSES)))
+    # load the recommender now instead of in a warm-up thread of every worker
+    model = main.recommender.get().active.model
+    if isinstance(model, torch.nn.Module):
+        model.share_memory()
+    # objects created so far are never collected in the workers, so the garbage
+    # collector does not write to (and copy) the pages they share with the parent
+    gc.freeze()
+    return main
+
+
+# Body of a forked worker: per-process state, then one uvicorn server on the shared socket
+def run_worker(app_module, sock, threads, log_level):
+    torch.set_num_threads(threads)
+    # database connections must not be shared with the parent
+    app_module.engine.dispose(close=False)
+    config = uvicorn.Config(app_module.app, log_level=log_level)
+    print(f"Worker {os.getpid()} serving with {threads} torch thread(s)")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn(app_module, sock, threads, log_level):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app_module, sock, threads, log_level)
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        os._exit(code)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the backend with several preforked workers.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads per worker (default: cores / workers)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    threads = args.threads or max(1, os.cpu_count() // args.workers)
+    sock = bind_socket(args.host, args.port)
+    app_module = preload(args.workers)
+
+    workers = {spawn(app_module, sock, threads, args.log_level) for _ in range(args.workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # replace workers that die, until asked to stop
+    while workers:
+        pid, status = os.wait()
+        workers.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}, starting a new one", file=sys.stderr)
+            time.sleep(1)
+            workers.add(spawn(app_module, sock, threads, args.log_level))
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import threading
+import time
+
+    # Heavy part of the server (e.g. the recommender) that is loaded on first use or
+    # by a background warm-up task instead of at import time.
+    # - start() begins loading in a background thread
+    # - get() returns the loaded value, loading it in the calling thread if nobody
+    #   started it yet, or waiting up to timeout seconds for the running load
+    # - A failed load is reported by get() and status() and not retried
+
+class LazySubsystem:
+    def __init__(self, name, load):
+        self.name = name
+        self.load = load
+        self.value = None
+        self.error = None
+        self.seconds = None
+        self.started = False
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self._claim():
+            threading.Thread(target=self._load, name=f"load-{self.name}", daemon=True).start()
+
+    def get(self, timeout=None):
+        if self._claim():
+            self._load()
+        elif not self.ready.wait(timeout):
+            raise TimeoutError(f"{self.name} is still loading")
+        if self.error is not None:
+            raise RuntimeError(f"{self.name} failed to load: {self.error}")
+        return self.value
+
+    # True if loaded successfully (never blocks)
+    def loaded(self):
+        return self.ready.is_set() and self.error is None
+
+    def status(self):
+        if not self.started:
+            state = "not loaded"
+        elif not self.ready.is_set():
+            state = "loading"
+        else:
+            state = "failed" if self.error is not None else "ready"
+        return {"status": state, "seconds": self.seconds, "error": self.error}
+
+    # Mark the subsystem as started; True for the caller that has to load it
+    def _claim(self):
+        with self.lock:
+            first = not self.started
+            self.started = True
+        return first
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            self.value = self.load()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            print(f"Loading {self.name} failed: {self.error}")
+        self.seconds = time.perf_counter() - start
+        self.ready.set()
@@ -0,0 +1,85 @@
+import contextlib
+import io
+import os
+import random
+import unittest
+import pandas as pd
+from network.inference import load_model, recommend_outfits
+from network.outfit_index import ITEM_COLUMNS, OutfitIndex
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_PATH = os.path.join(BACKEND_DIR, "network", "final_version.pth")
+WARDROBE_CSV = os.path.join(BACKEND_DIR, "network", "data", "scored_data", "out", "test.csv")
+USER_ID = 99
+
+# Bucket centres, so the index scores with the same weather as recommend_outfits
+WEATHERS = [
+    {"temperature": 22.0, "rain": 10.0, "wind": 3.0},
+    {"temperature": 16.0, "rain": 0.0, "wind": 1.0},
+    {"temperature": 8.5, "rain": 60.0, "wind": 8.0},
+]
+
+
+def load_wardrobe():
+    wardrobe = pd.read_csv(WARDROBE_CSV).rename(columns={"User_id": "user_id"})
+    return wardrobe[wardrobe["user_id"] == USER_ID].reset_index(drop=True)
+
+
+class OutfitIndexTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.model, cls.vocab = load_model(MODEL_PATH)
+        cls.wardrobe = load_wardrobe()
+
+    def setUp(self):
+        self.rng = random.Random(0)
+        self.next_id = int(self.wardrobe["item_id"].max()) + 1
+
+    # New item: a random type with the features of random other items
+    def new_item(self):
+        row = {c: self.wardrobe[c].iloc[self.rng.randrange(len(self.wardrobe))] for c in self.wardrobe.columns}
+        row.update(item_id=self.next_id, user_id=USER_ID, favorite=self.rng.randint(0, 1))
+        self.next_id += 1
+        return row
+
+    def assert_matches_exhaustive(self, index, wardrobe, top_k=5):
+        for weather in WEATHERS:
+            with contextlib.redirect_stdout(io.StringIO()):
+                got = index.recommend(USER_ID, wardrobe, weather, top_k=top_k)
+                expected = recommend_outfits(self.model, self.vocab, wardrobe, USER_ID, weather, top_k=top_k)
+            self.assertEqual([r[:3] for r in got], [r[:3] for r in expected], weather)
+            for g, e in zip(got, expected):
+                self.assertAlmostEqual(g[3], e[3], places=4)
+
+    # delete_item then add_item (the index is told about both changes)
+    def test_delete_then_add(self):
+        index = OutfitIndex(self.model, self.vocab, top_n=3)
+        wardrobe = self.wardrobe.copy()
+        self.assert_matches_exhaustive(index, wardrobe)
+        for _ in range(12):
+            item_id = wardrobe["item_id"].iloc[self.rng.randrange(len(wardrobe))]
+            wardrobe = wardrobe[wardrobe["item_id"] != item_id].reset_index(drop=True)
+            item = self.new_item()
+            wardrobe = pd.concat([wardrobe, pd.DataFrame([item])], ignore_index=True)
+            with contextlib.redirect_stdout(io.StringIO()):
+                index.remove_item(USER_ID, item_id)
+                index.add_item(USER_ID, {c: item[c] for c in ITEM_COLUMNS})
+            self.assert_matches_exhaustive(index, wardrobe)
+
+    # an item replaced by another between two reads (reconciled by recommend)
+    def test_replace_between_reads(self):
+        index = OutfitIndex(self.model, self.vocab, top_n=3)
+        wardrobe = self.wardrobe.copy()
+        self.assert_matches_exhaustive(index, wardrobe)
+        for _ in range(12):
+            position = self.rng.randrange(len(wardrobe))
+            wardrobe = pd.concat([wardrobe.drop(index=position), pd.DataFrame([self.new_item()])], ignore_index=True)
+            self.assert_matches_exhaustive(index, wardrobe)
+
+    def test_empty_wardrobe(self):
+        index = OutfitIndex(self.model, self.vocab)
+        self.assertEqual(index.recommend(USER_ID, self.wardrobe.iloc[0:0], WEATHERS[0]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from fastapi import HTTPException
+from weather.weather import WeatherClient
+
+# Seconds the stub server takes per request, so concurrent lookups overlap
+STUB_DELAY = 0.2
+CITIES = {"warsaw": (52.2297, 21.0122), "warszawa": (52.2311, 21.0122), "krakow": (50.0647, 19.945)}
+
+
+    # Local stand-in for the openweather geocoding (/geo) and one call (/onecall) endpoints.
+    # /broken answers with a body that is not JSON.
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.server.requests.append(url.path)
+        time.sleep(STUB_DELAY)
+        if url.path == "/geo":
+            city = CITIES.get(query["q"][0].strip().lower())
+            body = json.dumps([] if city is None else [{"lat": city[0], "lon": city[1]}])
+        elif url.path == "/onecall":
+            body = json.dumps({"daily": [
+                {"dt": 1760000000 + day * 86400, "temp": {"day": 10 + day}, "feels_like": {"day": 9 + day},
+                 "wind_speed": 3.0, "pop": 0.25}
+                for day in range(7)
+            ]})
+        else:
+            body = "not json"
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class WeatherClientTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.server.requests = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.requests.clear()
+
+    def new_client(self, **options):
+        client = WeatherClient(api_key="test", geocoding_url=self.base_url + "/geo",
+                               onecall_url=self.base_url + "/onecall", **options)
+        self.addAsyncCleanup(client.close)
+        return client
+
+    async def test_forecast(self):
+        client = self.new_client()
+        forecast = await client.fetch_weather("Warsaw")
+        self.assertEqual(len(forecast["forecast"]), 7)
+        self.assertEqual(forecast["forecast"][0], {"time": "2025-10-09", "temperature": 10, "feels_like": 9,
+                                                   "wind_speed": 3.0, "rain_chance": 25.0})
+
+    async def test_city_cache(self):
+        client = self.new_client(forecast_ttl=0)
+        await client.fetch_weather("Warsaw")
+        await client.fetch_weather(" warsaw ")
+        self.assertEqual(self.server.requests.count("/geo"), 1)
+        self.assertEqual(client.stats()["cities"], 1)
+
+    async def test_forecast_cache_and_expiry(self):
+        client = self.new_client(forecast_ttl=0.5)
+        await client.fetch_weather("Warsaw")
+        # a nearby city rounds to the same coordinates and shares the forecast
+        await client.fetch_weather("Warszawa")
+        self.assertEqual(self.server.requests.count("/onecall"), 1)
+        await asyncio.sleep(0.6)
+        await client.fetch_weather("Warsaw")
+        self.assertEqual(self.server.requests.count("/onecall"), 2)
+
+    async def test_concurrent_lookups_share_upstream_requests(self):
+        client = self.new_client()
+        results = await asyncio.gather(*[client.fetch_weather("Krakow") for _ in range(10)])
+        self.assertTrue(all(result == results[0] for result in results))
+        # one geocoding and one forecast request for all ten callers
+        self.assertEqual(client.upstream_requests, 2)
+        self.assertEqual(sorted(self.server.requests), ["/geo", "/onecall"])
+
+    async def test_unknown_city(self):
+        client = self.new_client()
+        with self.assertRaises(HTTPException) as raised:
+            await client.fetch_weather("Atlantis")
+        self.assertEqual(raised.exception.status_code, 404)
+
+    async def test_upstream_failures_are_502(self):
+        client = self.new_client()
+        client.onecall_url = self.base_url + "/broken"
+        with self.assertRaises(HTTPException) as raised:
+            await client.fetch_weather("Warsaw")
+        self.assertEqual(raised.exception.status_code, 502)
+
+        # nothing listens on port 1
+        client = self.new_client(timeout=2.0)
+        client.geocoding_url = "http://127.0.0.1:1/geo"
+        with self.assertRaises(HTTPException) as raised:
+            await client.fetch_weather("Krakow")
+        self.assertEqual(raised.exception.status_code, 502)
+        self.assertEqual(client.stats()["cities"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,39 +1,135 @@
-import requests
+import asyncio
+import time
 from datetime import datetime
+import httpx
+from fastapi import HTTPException
 
-# api key to access openweather 
+# api key to access openweather
 API_KEY = "be8cb59580baae4afd1256d90ee2b181"
 
-# Get latitude and longitude for a given city name
-def get_lon_lat(city: str):
-    url = f"http://api.openweathermap.org/geo/1.0/direct?q={city}&limit=1&appid={API_KEY}"
-    response = requests.get(url)
-    data = response.json()
-    if not data:
-        raise HTTPException(status_code=404, detail=f"City '{city}' not found")
-    lat = data[0]['lat']
-    lon = data[0]['lon']
-    return lat, lon
-
-
-# Fetch 7-day weather forecast for a city.
-def fetch_weather(city: str, long_term: bool = True):
-    lat, lon = get_lon_lat(city)
-    url = f"https://api.openweathermap.org/data/3.0/onecall?lat={lat}&lon={lon}&exclude=minutely,hourly,alerts&units=metric&appid={API_KEY}"
-    response = requests.get(url)
-    data = response.json()
-
-    if "daily" not in data:
-        raise HTTPException(status_code=500, detail="No daily data returned from weather API")
-
-    results = []
-    for d in data["daily"]:
-        results.append({
-            "time": datetime.utcfromtimestamp(d["dt"]).strftime("%Y-%m-%d"),
-            "temperature": d["temp"]["day"],
-            "feels_like": d["feels_like"]["day"],
-            "wind_speed": d["wind_speed"],
-            "rain_chance": d.get("pop", 0) * 100
-        })
-
-    return {"forecast": results}
\ No newline at end of file
+# openweather endpoints (e.g. a local stub server in tests)
+GEOCODING_URL = "http://api.openweathermap.org/geo/1.0/direct"
+ONECALL_URL = "https://api.openweathermap.org/data/3.0/onecall"
+
+# seconds a forecast is reused for the same (rounded) coordinates
+FORECAST_TTL = 600
+# decimals coordinates are rounded to for the forecast cache (2: about 1 km)
+COORDINATE_DECIMALS = 2
+# cities whose coordinates are kept (a city does not move, so they never expire)
+MAX_CITIES = 10000
+# seconds an upstream request may take
+TIMEOUT = 10.0
+
+
+    # Non-blocking openweather client.
+    # - One pooled httpx.AsyncClient (keep-alive connections) for all requests, created
+    #   on first use in the running event loop
+    # - City -> (lat, lon) lookups are cached for the lifetime of the process
+    # - Forecasts are cached for forecast_ttl seconds by coordinates rounded to
+    #   coordinate_decimals, so nearby or repeated cities share one forecast
+    # - Concurrent identical lookups (same city, same coordinates) share one upstream
+    #   request instead of each making their own
+
+class WeatherClient:
+    def __init__(self, api_key=API_KEY, geocoding_url=GEOCODING_URL, onecall_url=ONECALL_URL,
+                 forecast_ttl=FORECAST_TTL, coordinate_decimals=COORDINATE_DECIMALS, max_cities=MAX_CITIES,
+                 timeout=TIMEOUT):
+        self.api_key = api_key
+        self.geocoding_url = geocoding_url
+        self.onecall_url = onecall_url
+        self.forecast_ttl = forecast_ttl
+        self.coordinate_decimals = coordinate_decimals
+        self.max_cities = max_cities
+        self.timeout = timeout
+
+        self.client = None
+        self.locations = {}  # city (lower case) -> (lat, lon)
+        self.forecasts = {}  # rounded (lat, lon) -> (expiry time, forecast)
+        self.pending = {}  # cache key -> task of the upstream request in flight
+        self.upstream_requests = 0
+
+    # Get latitude and longitude for a given city name
+    async def get_lon_lat(self, city: str):
+        key = city.strip().lower()
+        if key not in self.locations:
+            location = await self._shared(("city", key), lambda: self._geocode(city))
+            if len(self.locations) >= self.max_cities:
+                self.locations.pop(next(iter(self.locations)))
+            self.locations[key] = location
+        return self.locations[key]
+
+    # Fetch 7-day weather forecast for a city.
+    async def fetch_weather(self, city: str, long_term: bool = True):
+        lat, lon = await self.get_lon_lat(city)
+        key = (round(lat, self.coordinate_decimals), round(lon, self.coordinate_decimals))
+        cached = self.forecasts.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        forecast = await self._shared(("forecast", key), lambda: self._forecast(*key))
+        self.forecasts[key] = (time.monotonic() + self.forecast_ttl, forecast)
+        # drop expired forecasts, so the cache only holds recently asked places
+        now = time.monotonic()
+        self.forecasts = {k: v for k, v in self.forecasts.items() if v[0] > now}
+        return forecast
+
+    def stats(self):
+        return {"cities": len(self.locations), "forecasts": len(self.forecasts),
+                "upstream_requests": self.upstream_requests}
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    # Run fetch once for all concurrent callers asking for the same key
+    async def _shared(self, key, fetch):
+        task = self.pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self.pending[key] = task
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+        # shield: a caller that disconnects does not cancel the request of the others
+        return await asyncio.shield(task)
+
+    async def _get(self, url, params):
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=self.timeout)
+        self.upstream_requests += 1
+        try:
+            response = await self.client.get(url, params={**params, "appid": self.api_key})
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise HTTPException(status_code=502, detail=f"Weather API request failed: {e}")
+
+    async def _geocode(self, city):
+        data = await self._get(self.geocoding_url, {"q": city, "limit": 1})
+        if not data:
+            raise HTTPException(status_code=404, detail=f"City '{city}' not found")
+        return data[0]['lat'], data[0]['lon']
+
+    async def _forecast(self, lat, lon):
+        data = await self._get(self.onecall_url, {"lat": lat, "lon": lon, "exclude": "minutely,hourly,alerts",
+                                                  "units": "metric"})
+        if "daily" not in data:
+            raise HTTPException(status_code=500, detail="No daily data returned from weather API")
+
+        results = []
+        for d in data["daily"]:
+            results.append({
+                "time": datetime.utcfromtimestamp(d["dt"]).strftime("%Y-%m-%d"),
+                "temperature": d["temp"]["day"],
+                "feels_like": d["feels_like"]["day"],
+                "wind_speed": d["wind_speed"],
+                "rain_chance": d.get("pop", 0) * 100
+            })
+
+        return {"forecast": results}
+
+
+# client shared by the endpoints of the app
+client = WeatherClient()
+
+
+async def fetch_weather(city: str, long_term: bool = True):
+    return await client.fetch_weather(city, long_term)